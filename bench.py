@@ -0,0 +1,450 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiogram.types import Update
+
+from callback_codec import FINISH, RESULTS, VOTE, encode
+
+# Нагрузочный тест пути голосования без сети: обновления с нажатиями кнопок подаются
+# в dp.feed_update, запросы бота принимает FakeSession. Каждый бот запускается в отдельном
+# процессе со своей временной папкой, так как настройки и файлы данных задаются при импорте модуля.
+#
+# python bench.py --bots gpt_bot test_sqlite bot_sqlite_group --users 1000 --options 5 --output bench.json
+# python bench.py --bots test_sqlite --storage tiered sqlite journal memory
+# python bench.py --conformance --storage tiered sqlite journal memory
+# python bench.py --flood --bots test_sqlite
+
+BOTS = ('gpt_bot', 'test_sqlite', 'bot_sqlite_group')
+STORAGE_BOTS = ('test_sqlite', 'bot_sqlite_group')  # боты, работающие через poll_storage.py
+STORAGES = ('tiered', 'sqlite', 'journal', 'memory')
+BENCH_ADMIN_ID = 838959021  # совпадает с ADMIN_IDS в test_sqlite.py
+BENCH_CHAT_ID = -1001
+# Проверка повторов после 429: FakeSession пропускает FLOOD_CHAT_LIMIT сообщений в секунду в чат,
+# а планировщик исходящих запросов считает, что можно вдвое больше
+FLOOD_CHAT_LIMIT = 5
+
+
+# Описание сценария для каждого бота: создание опроса и данные кнопок
+class BotScenario:
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        option_list = ', '.join(f'Вариант {i}' for i in range(1, options + 1))
+        if name == 'gpt_bot':
+            self.create_text = f'/create_poll Вопрос? {option_list}'
+        elif name == 'test_sqlite':
+            self.create_text = f'/create_poll Вопрос? {option_list}'
+        else:
+            self.create_text = f'Вопрос? {option_list}'
+
+    def vote_data(self, option):
+        if self.name == 'gpt_bot':
+            return f'option:{option}'
+        return encode(VOTE, 1, option + 1)
+
+    @property
+    def finish_data(self):
+        return 'done' if self.name == 'gpt_bot' else encode(FINISH, 1)
+
+    @property
+    def results_data(self):
+        return None if self.name == 'gpt_bot' else encode(RESULTS, 1)
+
+
+_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'}
+
+
+def message_update(text, user_id, chat_id=BENCH_CHAT_ID):
+    return Update.model_validate({'update_id': next(_ids), 'message': {
+        'message_id': next(_ids), 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'supergroup'},
+        'from': _user(user_id), 'text': text}})
+
+
+def callback_update(data, user_id, chat_id=BENCH_CHAT_ID, message_id=1):
+    return Update.model_validate({'update_id': next(_ids), 'callback_query': {
+        'id': str(next(_ids)), 'chat_instance': 'bench', 'from': _user(user_id), 'data': data,
+        'message': {'message_id': message_id, 'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'supergroup'}, 'text': 'Опрос'}}})
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def latency_summary(values):
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(max(values, default=0.0) * 1000, 3),
+    }
+
+
+# Проверка хранилища после сценария: у каждого пользователя должны остаться варианты, нажатые нечетное
+# число раз, а счетчики должны совпадать с выбором пользователей
+async def check_consistency(storage, plans):
+    expected = set()
+    for user_id, plan in enumerate(plans, start=1):
+        for option in plan:
+            expected ^= {(user_id, option + 1)}
+    votes = set()
+    for user_id in range(1, len(plans) + 1):
+        votes |= {(user_id, option_id) for option_id in await storage.get_selection(user_id, 1)}
+    counted = {}
+    for _, option_id in votes:
+        counted[option_id] = counted.get(option_id, 0) + 1
+    tallies = await storage.get_tallies(1)
+    return {
+        'lost_updates': len(expected ^ votes),
+        'tally_mismatches': sum(1 for option_id, count in tallies.items() if count != counted.get(option_id, 0)),
+    }
+
+
+# Общая проверка реализаций poll_storage.py: одинаковые результаты операций, сохранение данных
+# после перезапуска (кроме memory) и скорость переключения голосов без бота
+async def check_storage(kind, folder, users, votes_per_user):
+    from database import Database
+    from poll_storage import JournalStorage, MemoryStorage, SQLiteStorage, TieredStorage
+
+    def make():
+        if kind == 'tiered':
+            return TieredStorage(Database(os.path.join(folder, 'polls.db')))
+        if kind == 'sqlite':
+            return SQLiteStorage(Database(os.path.join(folder, 'polls.db')))
+        if kind == 'journal':
+            return JournalStorage(os.path.join(folder, 'polls.json'))
+        return MemoryStorage()
+
+    checks = {}
+    storage = make()
+    await storage.start()
+    first = await storage.create_poll('Первый?', ['a', 'b', 'c'], active=True)
+    second = await storage.create_poll('Второй?', ['x', 'y'])
+    poll, other = await storage.get_poll(first), await storage.get_poll(second)
+    a, b, c = [option_id for option_id, _ in poll.options]
+    checks['create'] = (poll.question == 'Первый?' and poll.active and not other.active
+                        and [text for _, text in poll.options] == ['a', 'b', 'c'])
+    checks['option_ids'] = len({option_id for option_id, _ in poll.options + other.options}) == 5
+    checks['unknown_poll'] = await storage.get_poll(first + second + 100) is None
+
+    toggles = [await storage.toggle_vote(1, first, option_id, 'user1') for option_id in (a, b, a)]
+    await storage.toggle_vote(2, first, b, 'user2')
+    checks['toggle'] = toggles == [{a}, {a, b}, {b}]
+    checks['selection'] = (await storage.get_selection(1, first) == {b}
+                           and await storage.get_selection(3, first) == set())
+    checks['tallies'] = dict(await storage.get_tallies(first)) == {a: 0, b: 2, c: 0}
+
+    checks['active'] = [p.poll_id for p in await storage.active_polls()] == [first]
+    await storage.open_poll(second)
+    checks['open'] = [p.poll_id for p in await storage.active_polls()] == [first, second]
+    checks['close'] = (await storage.close_poll(second) == [second] and await storage.close_poll() == [first]
+                       and await storage.active_polls() == [])
+    checks['close_unknown'] = await storage.close_poll(first + second + 100) == []
+    expected_results = [('Первый?', [('a', 0), ('b', 2), ('c', 0)]), ('Второй?', [('x', 0), ('y', 0)]),
+                        ('Третий?', [('1', 0), ('2', 0)])]
+    checks['closed_results'] = await storage.closed_results() == expected_results[:2]
+
+    third = await storage.create_poll('Третий?', ['1', '2'], active=True, closes_at=1000.5)
+    deadline_set = ((await storage.get_poll(third)).closes_at == 1000.5
+                    and [tuple(row) for row in await storage.pending_deadlines()] == [(third, 1000.5)])
+    await storage.close_poll(third)
+    checks['deadlines'] = deadline_set and await storage.pending_deadlines() == []
+
+    path = os.path.join(folder, 'export.ndjson')
+    rows = await storage.export(first, path, 'ndjson')
+    with open(path) as f:
+        exported = sorted((row['user_id'], row['option_id'], row['user_name']) for row in map(json.loads, f))
+    checks['export'] = rows == 2 and exported == [(1, b, 'user1'), (2, b, 'user2')]
+    await storage.close()
+
+    if kind != 'memory':
+        storage = make()
+        await storage.start()
+        checks['persistence'] = (await storage.get_selection(1, first) == {b}
+                                 and dict(await storage.get_tallies(first)) == {a: 0, b: 2, c: 0}
+                                 and await storage.closed_results() == expected_results)
+        await storage.close()
+
+    if kind == 'tiered':
+        # Аварийная остановка: голоса есть только в памяти и в журнале горячего слоя
+        storage = make()
+        await storage.start()
+        poll_id = await storage.create_poll('Сбой?', ['1', '2'], active=True)
+        crash_a, crash_b = [option_id for option_id, _ in (await storage.get_poll(poll_id)).options]
+        for option_id in (crash_a, crash_b, crash_a):
+            await storage.toggle_vote(7, poll_id, option_id, 'user7')
+        storage._flusher.cancel()
+        storage.log.close()
+        storage.db.close()
+        storage = make()
+        await storage.start()
+        checks['recovery'] = (storage.recovered == 2 and await storage.get_selection(7, poll_id) == {crash_b}
+                              and dict(await storage.get_tallies(poll_id)) == {crash_a: 0, crash_b: 1})
+        await storage.close_poll(poll_id)
+        checks['demotion'] = (await storage.get_selection(7, poll_id) == {crash_b}
+                              and dict(await storage.get_tallies(poll_id)) == {crash_a: 0, crash_b: 1})
+        await storage.close()
+
+    # Скорость: все пользователи переключают варианты одновременно
+    storage = make()
+    await storage.start()
+    poll_id = await storage.create_poll('Скорость?', ['1', '2', '3', '4'], active=True)
+    option_ids = [option_id for option_id, _ in (await storage.get_poll(poll_id)).options]
+    rng = random.Random(1)
+
+    async def user_votes(user_id):
+        for _ in range(votes_per_user):
+            await storage.toggle_vote(user_id, poll_id, rng.choice(option_ids))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_votes(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    await storage.close()
+
+    return {
+        'storage': kind,
+        'passed': all(checks.values()),
+        'failed': [name for name, ok in checks.items() if not ok],
+        'toggles': users * votes_per_user,
+        'toggles_per_sec': round(users * votes_per_user / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def run_conformance(kinds, users, votes_per_user):
+    results = []
+    for kind in kinds:
+        with tempfile.TemporaryDirectory(prefix=f'storage_{kind}_') as folder:
+            results.append(await check_storage(kind, folder, users, votes_per_user))
+    return results
+
+
+# Проверка планировщика исходящих запросов бота при ответах 429: все сообщения в один чат отправляются
+# одновременно, каждое должно в итоге дойти, а повторы — случиться
+async def run_flood(name, sends):
+    from fake_session import FakeSession
+
+    bot_module = importlib.import_module(name)
+    bot, outbound = bot_module.bot, bot_module.outbound
+    bot.session = session = FakeSession(chat_limit=FLOOD_CHAT_LIMIT)
+    session.middleware(outbound)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(bot.send_message(BENCH_CHAT_ID, f'Сообщение {i}') for i in range(sends)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    return {
+        'bot': name,
+        'chat_limit': FLOOD_CHAT_LIMIT,
+        'sends': sends,
+        'delivered': len(session.calls),
+        'failed': failed,
+        'flood_errors': session.flood_errors,
+        'retries': outbound.retries,
+        'seconds': round(elapsed, 3),
+        'passed': failed == 0 and len(session.calls) == sends and outbound.retries > 0,
+    }
+
+
+# Запуск сценария в текущем процессе; модуль бота импортируется здесь.
+# burst: нажатия одного пользователя отправляются одновременно, а не по очереди
+async def run_scenario(name, users, options, votes_per_user, concurrency, outbound, seed, burst=False,
+                       results_every=10):
+    from fake_session import FakeSession
+
+    bot_module = importlib.import_module(name)
+    dp, bot = bot_module.dp, bot_module.bot
+    bot.session = session = FakeSession()
+    if outbound:
+        session.middleware(bot_module.outbound)
+
+    if hasattr(bot_module, 'init_db'):
+        await bot_module.init_db()
+    if hasattr(bot_module, 'start_compaction'):
+        await bot_module.start_compaction()
+
+    scenario = BotScenario(name, options)
+    await dp.feed_update(bot, message_update(scenario.create_text, BENCH_ADMIN_ID))
+
+    latencies = {'vote': [], 'finish': [], 'results': []}
+    errors = 0
+    rng = random.Random(seed)
+    plans = [[rng.randrange(options) for _ in range(votes_per_user)] for _ in range(users)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def feed(kind, update):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            errors += 1
+        latencies[kind].append(time.perf_counter() - started)
+
+    # Каждый пользователь нажимает варианты по очереди (или все сразу в режиме burst), пользователи работают параллельно
+    async def user_session(user_id, plan):
+        async with semaphore:
+            if burst:
+                await asyncio.gather(*(feed('vote', callback_update(scenario.vote_data(option), user_id))
+                                       for option in plan))
+            else:
+                for option in plan:
+                    await feed('vote', callback_update(scenario.vote_data(option), user_id))
+            await feed('finish', callback_update(scenario.finish_data, user_id))
+            if scenario.results_data and results_every and user_id % results_every == 0:
+                await feed('results', callback_update(scenario.results_data, user_id))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(user_id, plan) for user_id, plan in enumerate(plans, start=1)))
+    if hasattr(bot_module, 'edits'):
+        await bot_module.edits.flush()
+    elapsed = time.perf_counter() - started
+
+    consistency = None
+    if name in STORAGE_BOTS:
+        consistency = await check_consistency(bot_module.storage, plans)
+    if hasattr(bot_module, 'shutdown'):
+        await bot_module.shutdown()
+
+    votes = len(latencies['vote'])
+    calls = {}
+    for method in session.calls:
+        calls[type(method).__name__] = calls.get(type(method).__name__, 0) + 1
+    return {
+        'bot': name,
+        'storage': os.getenv('POLL_STORAGE', 'sqlite') if name in STORAGE_BOTS else None,
+        'users': users,
+        'options': options,
+        'votes_per_user': votes_per_user,
+        'concurrency': concurrency,
+        'outbound': outbound,
+        'burst': burst,
+        'seconds': round(elapsed, 4),
+        'votes': votes,
+        'votes_per_sec': round(votes / elapsed, 1) if elapsed else 0.0,
+        'errors': errors,
+        'latency': {kind: latency_summary(values) for kind, values in latencies.items() if values},
+        'api_calls': calls,
+        'consistency': consistency,
+        'scheduler': bot_module.task_scheduler.stats() if hasattr(bot_module, 'task_scheduler') else None,
+        'shedding': bot_module.load_shedder.stats() if hasattr(bot_module, 'load_shedder') else None,
+    }
+
+
+# Запуск сценария в отдельном процессе с чистыми данными
+def run_isolated(name, args, storage='sqlite'):
+    with tempfile.TemporaryDirectory(prefix=f'bench_{name}_') as folder:
+        env = dict(os.environ, API_TOKEN='123456:bench', ADMIN_IDS=str(BENCH_ADMIN_ID),
+                   GROUP_ID=str(BENCH_CHAT_ID), DB_PATH=os.path.join(folder, 'polls.db'), POLL_STORAGE=storage,
+                   PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                            os.environ.get('PYTHONPATH')])))
+        if args.flood:
+            # Лимит планировщика выше лимита FakeSession, повторов хватает на все сообщения
+            env.update(OUTBOUND_GROUP_RATE=str(FLOOD_CHAT_LIMIT * 2), OUTBOUND_MAX_RETRIES=str(args.flood_sends))
+        command = [sys.executable, os.path.abspath(__file__), '--child', name,
+                   '--users', str(args.users), '--options', str(args.options),
+                   '--votes-per-user', str(args.votes_per_user), '--concurrency', str(args.concurrency),
+                   '--seed', str(args.seed), '--results-every', str(args.results_every)]
+        if args.outbound:
+            command.append('--outbound')
+        if args.burst:
+            command.append('--burst')
+        if args.flood:
+            command += ['--flood', '--flood-sends', str(args.flood_sends)]
+        result = subprocess.run(command, cwd=folder, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            return {'bot': name, 'error': result.stderr.strip().splitlines()[-1:] or ['failed']}
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# Список проблем отчета; при непустом списке bench.py завершается с кодом 1
+def report_failures(report):
+    failures = [f"{result['storage']}: {', '.join(result['failed'])}"
+                for result in report.get('conformance', []) if not result['passed']]
+    failures += [f"{result['bot']}: {' '.join(result['error'])}"
+                 for result in report.get('results', []) + report.get('flood', []) if 'error' in result]
+    failures += [f"{result['bot']}: доставлено {result['delivered']} из {result['sends']}, "
+                 f"повторов после 429: {result['retries']}"
+                 for result in report.get('flood', []) if 'error' not in result and not result['passed']]
+    failures += [f"{result['bot']} ({result['storage']}): потеряно обновлений {result['consistency']['lost_updates']}, "
+                 f"расхождений счетчиков {result['consistency']['tally_mismatches']}"
+                 for result in report.get('results', [])
+                 if result.get('consistency') and any(result['consistency'].values())]
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработки голосов")
+    parser.add_argument('--bots', nargs='+', choices=BOTS, default=list(BOTS))
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--options', type=int, default=4)
+    parser.add_argument('--votes-per-user', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--outbound', action='store_true', help="включить лимиты исходящих запросов")
+    parser.add_argument('--results-every', type=int, default=10,
+                        help="каждый N-й пользователь нажимает \"Посмотреть результаты\" (0 — никто)")
+    parser.add_argument('--burst', action='store_true',
+                        help="нажатия одного пользователя одновременно (проверка порядка обработки)")
+    parser.add_argument('--storage', nargs='+', choices=STORAGES, default=['tiered'],
+                        help="хранилища опросов для test_sqlite и bot_sqlite_group (см. poll_storage.py)")
+    parser.add_argument('--conformance', action='store_true',
+                        help="проверить реализации хранилища без бота вместо нагрузочного теста")
+    parser.add_argument('--flood', action='store_true',
+                        help="проверить повторы после 429 (FakeSession с лимитом на чат) вместо нагрузочного теста")
+    parser.add_argument('--flood-sends', type=int, default=30, help="сообщений в чат в режиме --flood")
+    parser.add_argument('--output', help="файл для JSON с результатами")
+    parser.add_argument('--child', choices=BOTS, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child and args.flood:
+        print(json.dumps(asyncio.run(run_flood(args.child, args.flood_sends))))
+        return
+    if args.child:
+        result = asyncio.run(run_scenario(args.child, args.users, args.options, args.votes_per_user,
+                                          args.concurrency, args.outbound, args.seed, args.burst,
+                                          args.results_every))
+        print(json.dumps(result))
+        return
+
+    report = {'started': int(time.time()), 'python': sys.version.split()[0]}
+    if args.conformance:
+        report['conformance'] = asyncio.run(run_conformance(args.storage, args.users, args.votes_per_user))
+    elif args.flood:
+        report['flood'] = [run_isolated(name, args) for name in args.bots]
+    else:
+        report['results'] = [run_isolated(name, args, storage)
+                             for name in args.bots
+                             for storage in (args.storage if name in STORAGE_BOTS else ['sqlite'])]
+    data = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    print(data)
+    failures = report_failures(report)
+    if failures:
+        print("Проверки не пройдены:\n" + "\n".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
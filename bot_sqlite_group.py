@@ -1,9 +1,23 @@
-import sqlite3
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import FSInputFile, Message, ReplyKeyboardMarkup, KeyboardButton
+
+from callback_codec import FINISH, RESULTS, VOTE, CallbackRoutes
+from deadline_scheduler import DeadlineScheduler, parse_duration
+from edits import EditCoordinator
+from export import export_filename, export_poll, parse_export_args
+from keyboards import FINISH_KEYBOARD, KeyboardTemplates
+from load_shedding import LoadShedder
+from metrics import Metrics
+from outbound import OutboundScheduler
+from prefilter import ChatterFilterMiddleware
+from poll_storage import create_storage
+from task_queues import KeyedScheduler, KeyedSchedulerMiddleware
+from webhook import run_bot
 
 # Загружаем переменные из .env файла
 load_dotenv()
@@ -12,70 +26,99 @@ API_TOKEN = os.getenv('API_TOKEN')
 ADMIN_IDS = set(map(int, os.getenv('ADMIN_IDS').split(',')))
 GROUP_ID = int(os.getenv('GROUP_ID'))
 
+# Тексты кнопок меню, которые обрабатываются у всех пользователей
+MENU_TEXTS = ("Создать новый опрос", "Запустить опрос", "Показать результаты", "Завершить активное голосование",
+              "Отмена")
+
 bot = Bot(token=API_TOKEN)
+outbound = OutboundScheduler()
+bot.session.middleware(outbound)  # Лимиты Telegram на отправку и повтор после 429
 dp = Dispatcher()
+callback_routes = CallbackRoutes()  # Нажатия кнопок опроса: действие из callback_data -> обработчик
+callback_routes.register(dp.callback_query)
+
+# Отбрасываем обычные сообщения группы до обработчиков: проходят команды, кнопки меню и администраторы
+chatter_filter = ChatterFilterMiddleware(MENU_TEXTS, ADMIN_IDS)
+dp.message.outer_middleware(chatter_filter)
+
+
+# Хранилище опросов: по умолчанию активные опросы в памяти с записью в SQLite, другие варианты через POLL_STORAGE
+# (см. poll_storage.py)
+storage = create_storage()
+keyboards = KeyboardTemplates()
+edits = EditCoordinator()
+
+# Нажатия одного пользователя в одном опросе обрабатываются по очереди, разные — параллельно
+task_scheduler = KeyedScheduler()
+dp.callback_query.middleware(KeyedSchedulerMiddleware(task_scheduler))
+
+# При наплыве: устаревшие нажатия отбрасываются, парные переключения одного варианта взаимно отменяются
+load_shedder = LoadShedder()
+load_shedder.setup(dp.callback_query)
+
+# Задержки обработчиков, запросов SQLite и Telegram API (/metrics и /stats). Регистрируется после очереди
+# нажатий и сброса нагрузки, чтобы время обработчика не включало ожидание в очереди
+metrics = Metrics()
+metrics.setup(dp, bot, getattr(storage, 'db', None))
+metrics.register_stats('tasks', task_scheduler.stats)
+metrics.register_stats('shedding', load_shedder.stats)
+metrics.register_stats('storage', storage.stats)
+
+
+# Инициализация хранилища опросов (для SQLite — миграции базы данных) и сроков завершения опросов.
+# При запуске через sharding.py сроки после перезапуска восстанавливает только первый процесс.
+async def init_db():
+    await storage.start()
+    if os.getenv('SHARD_ID', '0') == '0':
+        for poll_id, closes_at in await storage.pending_deadlines():
+            deadlines.schedule(poll_id, closes_at)
+
+
+# Результаты опроса по счетчикам хранилища: [(вариант, количество голосов)]
+async def get_poll_results(poll_id):
+    poll = await storage.get_poll(poll_id)
+    if poll is None:
+        return []
+    counts = await storage.get_tallies(poll_id)
+    return [(option_text, counts.get(option_id, 0)) for option_id, option_text in poll.options]
+
+
+# Завершение опроса по сроку: опрос закрывается, итоги отправляются в GROUP_ID
+async def close_expired_poll(poll_id):
+    poll = await storage.get_poll(poll_id)
+    if poll is None or not poll.active:
+        return
+    # Опрос могли перезапустить без срока или с более поздним сроком (например, в другом процессе)
+    if poll.closes_at is None or poll.closes_at > time.time():
+        return
+    await storage.close_poll(poll_id)
 
+    results = await get_poll_results(poll_id)
+    result_text = "\n".join([f"{option}: {count} голосов" for option, count in results])
+    await bot.send_message(GROUP_ID, f"Опрос завершен по времени.\n\nОпрос: {poll.question}\n{result_text}")
 
-# Соединение с базой данных SQLite
-def execute_query(query, args=(), fetch=False):
-    with sqlite3.connect('polls.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, args)
-        conn.commit()
-        if fetch:
-            return cursor.fetchall()
-
-
-# Инициализация базы данных
-def init_db():
-    execute_query('''CREATE TABLE IF NOT EXISTS polls (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        question TEXT,
-                        active INTEGER
-                    )''')
-    execute_query('''CREATE TABLE IF NOT EXISTS options (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        poll_id INTEGER,
-                        option_text TEXT,
-                        FOREIGN KEY (poll_id) REFERENCES polls (id)
-                    )''')
-    execute_query('''CREATE TABLE IF NOT EXISTS votes (
-                        user_id INTEGER,
-                        user_name TEXT,
-                        poll_id INTEGER,
-                        option_id INTEGER,
-                        PRIMARY KEY (user_id, poll_id, option_id),
-                        FOREIGN KEY (poll_id) REFERENCES polls (id)
-                    )''')
+
+# Один таймер на все опросы со сроком завершения
+deadlines = DeadlineScheduler(close_expired_poll)
+metrics.register_stats('deadlines', deadlines.stats)
 
 
 # Функция для создания клавиатуры с вариантами ответов
-def create_poll_keyboard(poll_id, selected_options=None, is_voting=True):
-    options = execute_query("SELECT id, option_text FROM options WHERE poll_id = ?", (poll_id,), fetch=True)
+async def create_poll_keyboard(poll_id, selected_options=None, is_voting=True):
+    poll = await storage.get_poll(poll_id)
+    options = poll.options if poll else None
 
     if not options:
         print(f"Не найдены варианты для опроса с poll_id = {poll_id}")
         return None
 
-    buttons = []
-    for option_id, option_text in options:
-        button_text = f"✓ {option_text}" if selected_options and option_id in selected_options else option_text
-        buttons.append([InlineKeyboardButton(text=button_text, callback_data=f'vote:{poll_id}:{option_id}')])
-
-    if is_voting:
-        buttons.append([InlineKeyboardButton(text="Проголосовать", callback_data=f'finish_vote:{poll_id}')])
-    else:
-        buttons.append([InlineKeyboardButton(text="Посмотреть результаты", callback_data=f'show_results:{poll_id}')])
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    return keyboard
+    # Клавиатура собирается из готового шаблона опроса по набору выбранных вариантов
+    return keyboards.build(poll_id, options, selected_options, is_voting)
 
 
 # Функция для создания клавиатуры с завершением голосования
 def create_finish_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Голосование завершено", callback_data='voting_ended')]
-    ])
+    return FINISH_KEYBOARD
 
 
 # Функция для создания главного меню
@@ -111,36 +154,39 @@ async def create_poll(message: Message):
                         ))
 
 
-# Обработчик текста для создания опроса
-@dp.message(F.text)
-async def handle_create_poll(message: Message):
-    if message.text.lower() == "отмена":
-        await message.reply("Создание опроса отменено.",
-                            reply_markup=create_main_menu(is_admin=is_admin(message.from_user.id)))
+# Сводка метрик для администратора
+@dp.message(Command('stats'))
+async def stats_command(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.reply("У вас нет прав для просмотра статистики.")
         return
+    stats = chatter_filter.stats()
+    await message.reply(f"{metrics.summary()}\n\nСообщений пропущено: {stats['passed']}, "
+                        f"отброшено: {sum(stats['dropped'].values())}")
+
 
+# Выгрузка голосов опроса файлом: /export <poll_id> [csv|ndjson]
+@dp.message(Command('export'))
+async def export_command(message: Message):
     if not is_admin(message.from_user.id):
+        await message.reply("У вас нет прав для выгрузки результатов.")
         return
 
-    parts = message.text.split('?')
-    if len(parts) != 2:
-        await message.reply("Неправильный формат команды. Пример: Вопрос? Вариант 1, Вариант 2, Вариант 3")
+    args = parse_export_args(message.text)
+    if args is None:
+        await message.reply("Пример: /export 1 csv (форматы: csv, ndjson)")
         return
 
-    question = parts[0].strip()
-    options = parts[1].split(',')
-    options = [option.strip() for option in options]
-
-    # Вставляем вопрос в базу данных
-    execute_query("INSERT INTO polls (question, active) VALUES (?, 0)", (question,))
-    poll_id = execute_query("SELECT last_insert_rowid()", fetch=True)[0][0]
-
-    # Вставляем варианты в базу данных
-    for option in options:
-        execute_query("INSERT INTO options (poll_id, option_text) VALUES (?, ?)", (poll_id, option))
-
-    await message.reply(f"Опрос создан. Используйте команду /start_poll {poll_id} для запуска опроса.",
-                        reply_markup=create_main_menu(is_admin=is_admin(message.from_user.id)))
+    poll_id, fmt = args
+    path, rows = await export_poll(storage, poll_id, fmt)
+    try:
+        if not rows:
+            await message.reply("В этом опросе нет голосов.")
+            return
+        await message.reply_document(FSInputFile(path, filename=export_filename(poll_id, fmt)),
+                                     caption=f"Голосов: {rows}")
+    finally:
+        os.remove(path)
 
 
 # Команда для запуска опроса
@@ -150,30 +196,40 @@ async def start_poll(message: Message):
         await message.reply("У вас нет прав для запуска опроса.")
         return
 
+    # Необязательная длительность после id: /start_poll 1 30m
+    args = message.text.split()
+    duration = parse_duration(args[2]) if len(args) > 2 else None
     try:
-        poll_id = int(message.text.split()[1])
+        poll_id = int(args[1])
+        if len(args) > 2 and duration is None:
+            raise ValueError
     except (IndexError, ValueError):
-        await message.reply("Введите команду для запуска опроса. Пример: /start_poll 1")
+        await message.reply("Введите команду для запуска опроса. Пример: /start_poll 1 или /start_poll 1 30m "
+                            "(длительность: 90s, 30m, 2h, 1d)")
         return
 
-    # Помечаем опрос как активный
-    execute_query("UPDATE polls SET active = 1 WHERE id = ?", (poll_id,))
-
-    # Получаем вопрос и варианты
-    question = execute_query("SELECT question FROM polls WHERE id = ?", (poll_id,), fetch=True)
-    if question:
-        question = question[0][0]
+    # Получаем вопрос и варианты до запуска, чтобы не ставить срок несуществующему опросу
+    poll = await storage.get_poll(poll_id)
+    if poll:
+        question = poll.question
     else:
         await message.reply("Опрос не найден.")
         return
 
-    options = execute_query("SELECT id, option_text FROM options WHERE poll_id = ?", (poll_id,), fetch=True)
-    if not options:
+    if not poll.options:
         await message.reply("Варианты для опроса не найдены.")
         return
 
+    # Помечаем опрос как активный; со сроком он завершится автоматически
+    closes_at = time.time() + duration if duration else None
+    await storage.open_poll(poll_id, closes_at)
+    if closes_at:
+        deadlines.schedule(poll_id, closes_at)
+    else:
+        deadlines.cancel(poll_id)
+
     # Отправляем сообщение с опросом
-    poll_keyboard = create_poll_keyboard(poll_id)
+    poll_keyboard = await create_poll_keyboard(poll_id)
     if poll_keyboard:
         await message.reply(f"Опрос: {question}\nВыберите один или несколько вариантов:", reply_markup=poll_keyboard)
     else:
@@ -181,125 +237,71 @@ async def start_poll(message: Message):
 
 
 # Обработчик голосования
-@dp.callback_query(F.data.startswith('vote:'))
-async def handle_vote(callback_query):
-    _, poll_id, option_id = callback_query.data.split(':')
-    poll_id = int(poll_id)
-    option_id = int(option_id)
+@callback_routes.route(VOTE)
+async def handle_vote(callback_query, poll_id, option_id):
     user_id = callback_query.from_user.id
     user_name = callback_query.from_user.username or "Unknown"  # Используйте username или "Unknown" если его нет
 
-    # Обработка голосования
-    existing_vote = execute_query("SELECT option_id FROM votes WHERE user_id = ? AND poll_id = ?", (user_id, poll_id),
-                                  fetch=True)
-    existing_votes = {vote_id for vote_id, in existing_vote}
-
-    if option_id in existing_votes:
-        execute_query("DELETE FROM votes WHERE user_id = ? AND poll_id = ? AND option_id = ?",
-                      (user_id, poll_id, option_id))
-    else:
-        execute_query("INSERT INTO votes (user_id, user_name, poll_id, option_id) VALUES (?, ?, ?, ?)",
-                      (user_id, user_name, poll_id, option_id))
-
-    # Получаем обновленные выбранные варианты для текущего пользователя
-    user_votes = execute_query("SELECT option_id FROM votes WHERE user_id = ? AND poll_id = ?", (user_id, poll_id),
-                               fetch=True)
-    selected_options = {option_id for option_id, in user_votes}
+    # Обработка голосования через хранилище, получаем обновленные выбранные варианты
+    selected_options = await storage.toggle_vote(user_id, poll_id, option_id, user_name)
 
     # Получаем вопрос опроса
-    question = execute_query("SELECT question FROM polls WHERE id = ?", (poll_id,), fetch=True)
-    if question:
-        question = question[0][0]
-    else:
-        question = "Вопрос не найден"
+    poll = await storage.get_poll(poll_id)
+    question = poll.question if poll else "Вопрос не найден"
 
     # Создаем клавиатуру с обновленным состоянием
-    new_poll_keyboard = create_poll_keyboard(poll_id, selected_options)
+    new_poll_keyboard = await create_poll_keyboard(poll_id, selected_options)
 
     if new_poll_keyboard:
-        # Обновляем сообщение с опросом
-        await callback_query.message.edit_text(
-            text=f"Опрос: {question}\nВыберите один или несколько вариантов:",
-            reply_markup=new_poll_keyboard
-        )
+        # Отвечаем сразу, а обновление сообщения откладываем и объединяем с соседними нажатиями
+        await callback_query.answer()
+        edits.schedule(bot, callback_query.message.chat.id, callback_query.message.message_id,
+                       text=f"Опрос: {question}\nВыберите один или несколько вариантов:",
+                       reply_markup=new_poll_keyboard)
     else:
         # Сообщаем об ошибке
         await callback_query.answer("Ошибка: невозможно обновить клавиатуру для опроса.", show_alert=True)
 
-    await callback_query.answer()
-
 
 # Обработчик завершения голосования (кнопка "Проголосовать")
-@dp.callback_query(F.data.startswith('finish_vote'))
-async def finish_vote(callback_query):
-    _, poll_id = callback_query.data.split(':')
-    poll_id = int(poll_id)
-
+@callback_routes.route(FINISH)
+async def finish_vote(callback_query, poll_id):
     user_id = callback_query.from_user.id
 
     # Получаем вопрос и варианты ответа
-    question = execute_query("SELECT question FROM polls WHERE id = ?", (poll_id,), fetch=True)
-    if question:
-        question = question[0][0]
-    else:
-        question = "Вопрос не найден"
+    poll = await storage.get_poll(poll_id)
+    question = poll.question if poll else "Вопрос не найден"
 
     # Получаем результаты
-    results = execute_query("""
-        SELECT option_text, user_name, COUNT(votes.option_id) 
-        FROM options
-        LEFT JOIN votes ON options.id = votes.option_id
-        WHERE options.poll_id = ?
-        GROUP BY options.id, user_name
-    """, (poll_id,), fetch=True)
-
-    result_text = "\n".join(
-        [f"{option_text} - {user_name}: {count} голосов" for option_text, user_name, count in results])
+    results = await get_poll_results(poll_id)
+
+    result_text = "\n".join([f"{option}: {count} голосов" for option, count in results])
     result_text = f"Ваш голос учтен.\n\nОпрос: {question}\n{result_text}"
 
     # Обновляем сообщение с результатами
     finish_keyboard = create_finish_keyboard()
-    await callback_query.message.edit_text(
-        text=result_text,
-        reply_markup=finish_keyboard
-    )
-
     await callback_query.answer()
+    edits.schedule(bot, callback_query.message.chat.id, callback_query.message.message_id,
+                   text=result_text, reply_markup=finish_keyboard)
 
 
 # Обработчик показа результатов
-@dp.callback_query(F.data.startswith('show_results'))
-async def show_results(callback_query):
-    _, poll_id = callback_query.data.split(':')
-    poll_id = int(poll_id)
-
+@callback_routes.route(RESULTS)
+async def show_results(callback_query, poll_id):
     # Получаем вопрос и результаты
-    question = execute_query("SELECT question FROM polls WHERE id = ?", (poll_id,), fetch=True)
-    if question:
-        question = question[0][0]
-    else:
-        question = "Вопрос не найден"
-
-    results = execute_query("""
-        SELECT option_text, user_name, COUNT(votes.option_id) 
-        FROM options
-        LEFT JOIN votes ON options.id = votes.option_id
-        WHERE options.poll_id = ?
-        GROUP BY options.id, user_name
-    """, (poll_id,), fetch=True)
-
-    result_text = "\n".join(
-        [f"{option_text} - {user_name}: {count} голосов" for option_text, user_name, count in results])
+    poll = await storage.get_poll(poll_id)
+    question = poll.question if poll else "Вопрос не найден"
+
+    results = await get_poll_results(poll_id)
+
+    result_text = "\n".join([f"{option}: {count} голосов" for option, count in results])
     result_text = f"Результаты опроса:\nВопрос: {question}\n{result_text}"
 
     # Обновляем сообщение с результатами
     finish_keyboard = create_finish_keyboard()
-    await callback_query.message.edit_text(
-        text=result_text,
-        reply_markup=finish_keyboard
-    )
-
     await callback_query.answer()
+    edits.schedule(bot, callback_query.message.chat.id, callback_query.message.message_id,
+                   text=result_text, reply_markup=finish_keyboard)
 
 
 # Обработчик создания нового опроса
@@ -321,7 +323,7 @@ async def start_poll_menu(message: Message):
     if not is_admin(message.from_user.id):
         await message.reply("У вас нет прав для запуска опроса.")
         return
-    await message.reply("Введите команду для запуска опроса в формате: /start_poll <poll_id>")
+    await message.reply("Введите команду для запуска опроса в формате: /start_poll <poll_id> [длительность, например 30m]")
 
 
 # Обработчик показа результатов
@@ -339,13 +341,52 @@ async def end_active_poll(message: Message):
     if not is_admin(message.from_user.id):
         await message.reply("У вас нет прав для завершения голосования.")
         return
-    execute_query("UPDATE polls SET active = 0 WHERE active = 1")
+    for poll_id in await storage.close_poll():
+        deadlines.cancel(poll_id)
     await message.reply("Активное голосование завершено.", reply_markup=create_main_menu(is_admin=True))
 
 
-# Основной блок
-if __name__ == "__main__":
-    init_db()
-    from aiogram import executor
+# Обработчик текста для создания опроса. Принимает любой текст, поэтому регистрируется последним,
+# после команд и кнопок меню; обычную переписку группы отсекает chatter_filter
+@dp.message(F.text)
+async def handle_create_poll(message: Message):
+    if message.text.lower() == "отмена":
+        await message.reply("Создание опроса отменено.",
+                            reply_markup=create_main_menu(is_admin=is_admin(message.from_user.id)))
+        return
+
+    if not is_admin(message.from_user.id):
+        return
 
-    executor.start_polling(dp, skip_updates=True)
+    parts = message.text.split('?')
+    if len(parts) != 2:
+        await message.reply("Неправильный формат команды. Пример: Вопрос? Вариант 1, Вариант 2, Вариант 3")
+        return
+
+    question = parts[0].strip()
+    options = parts[1].split(',')
+    options = [option.strip() for option in options]
+
+    # Сохраняем вопрос и варианты; опрос запускается отдельно командой /start_poll
+    poll_id = await storage.create_poll(question, options)
+
+    await message.reply(f"Опрос создан. Используйте команду /start_poll {poll_id} для запуска опроса.",
+                        reply_markup=create_main_menu(is_admin=is_admin(message.from_user.id)))
+
+
+# Остановка бота: останавливаем таймер сроков, отправляем отложенные правки, записываем голоса и закрываем хранилище
+async def shutdown():
+    await deadlines.close()
+    await edits.flush()
+    await storage.close()
+
+
+# Запуск бота
+async def main():
+    dp.startup.register(init_db)  # Инициализация хранилища опросов
+    dp.shutdown.register(shutdown)
+    await run_bot(dp, bot, drop_pending_updates=True, metrics=metrics)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+import string
+
+# Компактный формат callback_data: версия, код действия и числа в base36 через точку,
+# например "1vrs.a3" — голос в опросе 1000 за вариант 363. Telegram ограничивает callback_data 64 байтами.
+CODEC_VERSION = '1'
+MAX_CALLBACK_BYTES = 64
+
+VOTE = 'v'
+FINISH = 'f'
+RESULTS = 'r'
+
+# Формат до версии 1: "vote:<poll>:<option>", "finish_vote:<poll>", "show_results:<poll>".
+# Кнопки уже отправленных сообщений продолжают работать.
+LEGACY_ACTIONS = {'vote': VOTE, 'finish_vote': FINISH, 'show_results': RESULTS}
+
+_DIGITS = string.digits + string.ascii_lowercase
+
+
+def _base36(number):
+    if number < 0:
+        raise ValueError("Идентификатор не может быть отрицательным")
+    if number == 0:
+        return '0'
+    digits = []
+    while number:
+        number, rest = divmod(number, 36)
+        digits.append(_DIGITS[rest])
+    return ''.join(reversed(digits))
+
+
+def encode(action, *ids):
+    data = CODEC_VERSION + action + '.'.join(_base36(value) for value in ids)
+    if len(data) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {data}")
+    return data
+
+
+# Возвращает (действие, идентификаторы) или None для чужих и поврежденных данных
+def decode(data):
+    if not data:
+        return None
+    try:
+        if data[0] == CODEC_VERSION:
+            body = data[2:]
+            return data[1], tuple(int(value, 36) for value in body.split('.')) if body else ()
+        name, *ids = data.split(':')
+        action = LEGACY_ACTIONS.get(name)
+        if action is None:
+            return None
+        return action, tuple(int(value) for value in ids)
+    except (IndexError, ValueError):
+        return None
+
+
+# Таблица обработчиков нажатий по коду действия: вместо цепочки фильтров F.data.startswith(...)
+# callback_data разбирается один раз, обработчик выбирается поиском в словаре.
+class CallbackRoutes:
+    def __init__(self):
+        self.handlers = {}
+        self.arity = {}  # действие -> число идентификаторов
+
+    # Регистрирует обработчик handler(callback_query, *ids) для действия
+    def route(self, action):
+        def decorator(handler):
+            self.handlers[action] = handler
+            self.arity[action] = handler.__code__.co_argcount - 1
+            return handler
+        return decorator
+
+    # Фильтр aiogram: добавляет в данные обработчика найденную функцию и разобранные идентификаторы
+    def match(self, callback_query):
+        decoded = decode(callback_query.data)
+        if decoded is None:
+            return False
+        action, ids = decoded
+        handler = self.handlers.get(action)
+        if handler is None or len(ids) != self.arity[action]:
+            return False
+        return {'callback_handler': handler, 'callback_ids': ids}
+
+    async def dispatch(self, callback_query, callback_handler, callback_ids):
+        return await callback_handler(callback_query, *callback_ids)
+
+    def register(self, observer):
+        observer.register(self.dispatch, self.match)
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import SLOW_QUERY_LOG, ProfiledConnection, QueryProfiler
+
+DB_PATH = os.getenv('DB_PATH', 'polls.db')
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+DB_CACHE_KB = int(os.getenv('DB_CACHE_KB', '16384'))
+DB_CHECKPOINT_INTERVAL = float(os.getenv('DB_CHECKPOINT_INTERVAL', '30'))
+DB_WAL_LIMIT = int(os.getenv('DB_WAL_LIMIT_MB', '64')) * 1024 * 1024  # после этого размера WAL усекается
+
+logger = logging.getLogger(__name__)
+
+
+# Долгоживущее подключение к SQLite в режиме WAL: одно соединение-писатель и пул соединений-читателей
+# только для чтения. Читатели видят последний зафиксированный снимок и не блокируют запись голосов.
+# Все запросы выполняются в отдельных потоках, поэтому обработчики aiogram не блокируют цикл событий.
+# Checkpoint журнала WAL выполняется отдельным соединением в своем потоке (см. run_checkpoints).
+class Database:
+    def __init__(self, path=DB_PATH, readers=DB_READERS):
+        self.path = path
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+        self._reader_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='sqlite-reader')
+        self._checkpoint_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-checkpoint')
+        self._writer = None
+        self._checkpointer = None
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.observer = None  # observer(запрос или имя функции, секунды, строк), см. metrics.py
+        self.profiler = QueryProfiler() if SLOW_QUERY_LOG else None  # журнал медленных запросов, см. profiling.py
+        self.checkpoints = 0
+        self.checkpoints_busy = 0
+        self.truncations = 0
+
+    def _connect(self, readonly=False):
+        if readonly:
+            uri = 'file:' + urllib.parse.quote(os.path.abspath(self.path)) + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KB}")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    # Соединение-писатель создается один раз в потоке писателя
+    def _writer_connection(self):
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+
+    # У каждого потока-читателя свое соединение только для чтения
+    def _reader_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect(readonly=True)
+        return conn
+
+    def _observe(self, name, started, rows):
+        if self.observer is not None:
+            self.observer(name, time.perf_counter() - started, rows)
+
+    def _profile(self, conn, query, args, started, rows):
+        if self.profiler is not None:
+            self.profiler.record(conn, query, args, time.perf_counter() - started, rows)
+
+    # Функциям transaction и read при включенном профилировании передается соединение с замером каждого запроса
+    def _wrap(self, conn):
+        return conn if self.profiler is None else ProfiledConnection(conn, self.profiler)
+
+    def _write(self, query, args):
+        conn = self._writer_connection()
+        started = time.perf_counter()
+        with conn:
+            cursor = conn.execute(query, args)
+        self._profile(conn, query, args, started, cursor.rowcount)
+        self._observe(query, started, cursor.rowcount)
+        return cursor.lastrowid
+
+    def _fetch(self, query, args):
+        conn = self._reader_connection()
+        started = time.perf_counter()
+        rows = conn.execute(query, args).fetchall()
+        self._profile(conn, query, args, started, len(rows))
+        self._observe(query, started, len(rows))
+        return rows
+
+    def _transaction(self, func, args):
+        conn = self._writer_connection()
+        started = time.perf_counter()
+        changes = conn.total_changes
+        with conn:
+            result = func(self._wrap(conn), *args)
+        self._observe(func.__name__, started, conn.total_changes - changes)
+        return result
+
+    def _read(self, func, args, snapshot=False):
+        conn = self._reader_connection()
+        started = time.perf_counter()
+        if snapshot:
+            # Все запросы func видят один и тот же зафиксированный снимок базы
+            conn.execute("BEGIN")
+            try:
+                result = func(self._wrap(conn), *args)
+            finally:
+                conn.execute("COMMIT")
+        else:
+            result = func(self._wrap(conn), *args)
+        self._observe(func.__name__, started, len(result) if isinstance(result, list) else 0)
+        return result
+
+    def _checkpoint(self, mode):
+        if self._checkpointer is None:
+            self._checkpointer = self._connect()
+        busy, wal_pages, checkpointed = self._checkpointer.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        self.checkpoints += 1
+        if busy:
+            self.checkpoints_busy += 1
+        return busy, wal_pages, checkpointed
+
+    async def _run(self, executor, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, *args)
+
+    # Изменяющий запрос через соединение-писатель, возвращает lastrowid
+    async def execute(self, query, args=()):
+        return await self._run(self._writer_executor, self._write, query, args)
+
+    # Читающий запрос через пул читателей
+    async def fetch(self, query, args=()):
+        return await self._run(self._reader_executor, self._fetch, query, args)
+
+    # Выполняет func(conn, *args) в одной транзакции писателя
+    async def transaction(self, func, *args):
+        return await self._run(self._writer_executor, self._transaction, func, args)
+
+    # Выполняет func(conn, *args) на соединении-читателе
+    async def read(self, func, *args):
+        return await self._run(self._reader_executor, self._read, func, args)
+
+    # Как read, но все запросы func выполняются в одной читающей транзакции
+    async def snapshot(self, func, *args):
+        return await self._run(self._reader_executor, self._read, func, args, True)
+
+    # PASSIVE не мешает ни писателю, ни читателям; TRUNCATE дожидается читателей и обнуляет файл WAL
+    async def checkpoint(self, mode='PASSIVE'):
+        return await self._run(self._checkpoint_executor, self._checkpoint, mode)
+
+    def wal_size(self):
+        try:
+            return os.path.getsize(self.path + '-wal')
+        except OSError:
+            return 0
+
+    # Периодический checkpoint: при постоянных читателях автоматический checkpoint SQLite
+    # не успевает дойти до конца журнала, и файл WAL растет без ограничений
+    async def run_checkpoints(self, interval=DB_CHECKPOINT_INTERVAL, wal_limit=DB_WAL_LIMIT):
+        while True:
+            await asyncio.sleep(interval)
+            mode = 'PASSIVE'
+            if self.wal_size() > wal_limit:
+                mode = 'TRUNCATE'
+                self.truncations += 1
+            try:
+                await self.checkpoint(mode)
+            except sqlite3.Error:
+                logger.exception("Не удалось выполнить checkpoint %s", self.path)
+
+    def stats(self):
+        return {'wal_bytes': self.wal_size(), 'checkpoints': self.checkpoints,
+                'checkpoints_busy': self.checkpoints_busy, 'truncations': self.truncations}
+
+    def close(self):
+        self._writer_executor.shutdown(wait=True)
+        self._reader_executor.shutdown(wait=True)
+        self._checkpoint_executor.shutdown(wait=True)
+        if self.profiler is not None:
+            self.profiler.close()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._writer = None
+        self._checkpointer = None
@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_DURATION_RE = re.compile(r'^(\d+)([smhd])$')
+
+
+# Длительность вида 90s, 30m, 2h, 1d в секундах; None, если текст не похож на длительность
+def parse_duration(text):
+    match = _DURATION_RE.match(text.strip().lower())
+    if match is None:
+        return None
+    seconds = int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+    return seconds or None
+
+
+# Автоматическое завершение опросов по времени. Сроки (unix time) хранятся в куче,
+# а ожидает только один таймер цикла событий — до ближайшего срока; при добавлении более раннего
+# срока таймер переставляется. Отмена ленивая: запись в куче пропускается, если срок опроса
+# в _deadlines уже другой. Когда срок наступает, вызывается callback(poll_id) в отдельной задаче.
+class DeadlineScheduler:
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []  # (срок, poll_id)
+        self._deadlines = {}  # poll_id -> действующий срок
+        self._timer = None
+        self._timer_at = None
+        self._tasks = set()
+        self.fired = 0
+
+    def schedule(self, poll_id, closes_at):
+        self._deadlines[poll_id] = closes_at
+        heapq.heappush(self._heap, (closes_at, poll_id))
+        if self._timer_at is None or closes_at < self._timer_at:
+            self._arm()
+
+    def cancel(self, poll_id):
+        self._deadlines.pop(poll_id, None)
+
+    # Ставит таймер на ближайший действующий срок
+    def _arm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_at = None
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if self._heap:
+            self._timer_at = self._heap[0][0]
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(max(0.0, self._timer_at - time.time()), self._fire)
+
+    def _fire(self):
+        self._timer = self._timer_at = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            closes_at, poll_id = heapq.heappop(self._heap)
+            if self._deadlines.get(poll_id) != closes_at:
+                continue
+            del self._deadlines[poll_id]
+            self.fired += 1
+            task = asyncio.ensure_future(self._run(poll_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._arm()
+
+    async def _run(self, poll_id):
+        try:
+            await self.callback(poll_id)
+        except Exception:
+            logger.exception("Не удалось завершить опрос %s по времени", poll_id)
+
+    def stats(self):
+        return {'scheduled': len(self._deadlines), 'fired': self.fired, 'running': len(self._tasks)}
+
+    # Останавливает таймер и дожидается уже начатых завершений
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_at = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramBadRequest
+
+EDIT_COALESCE_WINDOW = float(os.getenv('EDIT_COALESCE_WINDOW', '0.3'))
+EDIT_STATE_SIZE = int(os.getenv('EDIT_STATE_SIZE', '10000'))
+
+logger = logging.getLogger(__name__)
+
+
+# Координатор редактирования сообщений: правки одного сообщения (chat_id, message_id),
+# пришедшие в течение окна, объединяются и отправляется только последняя.
+# Правка пропускается, если текст и клавиатура не отличаются от уже отправленных.
+class EditCoordinator:
+    def __init__(self, window=EDIT_COALESCE_WINDOW, state_size=EDIT_STATE_SIZE):
+        self.window = window
+        self.state_size = state_size
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self._pending = {}
+        self._tasks = {}
+        self._sending = set()  # ключи, правка которых уже отправляется
+        self._last = OrderedDict()
+        self._closing = False
+
+    def schedule(self, bot, chat_id, message_id, text, reply_markup=None):
+        key = (chat_id, message_id)
+        if key in self._pending:
+            self.coalesced += 1
+        elif key not in self._tasks and self._last.get(key) == (text, reply_markup):
+            self.skipped += 1
+            return
+
+        self._pending[key] = (bot, text, reply_markup)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._send_later(key))
+
+    async def _send_later(self, key):
+        try:
+            await asyncio.sleep(self.window)
+            self._sending.add(key)
+            await self._send(key)
+        finally:
+            self._sending.discard(key)
+            self._tasks.pop(key, None)
+            # Пока шла отправка, могла прийти новая правка
+            if key in self._pending and not self._closing:
+                self._tasks[key] = asyncio.create_task(self._send_later(key))
+
+    async def _send(self, key):
+        bot, text, reply_markup = self._pending.pop(key)
+        if self._last.get(key) == (text, reply_markup):
+            self.skipped += 1
+            return
+
+        chat_id, message_id = key
+        try:
+            await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if 'message is not modified' not in e.message:
+                logger.warning("Не удалось обновить сообщение %s: %s", key, e.message)
+                return
+        except Exception:
+            logger.exception("Ошибка при обновлении сообщения %s", key)
+            return
+
+        self.sent += 1
+        self._last[key] = (text, reply_markup)
+        self._last.move_to_end(key)
+        if len(self._last) > self.state_size:
+            self._last.popitem(last=False)
+
+    # Отправляет все отложенные правки сразу; вызывается при остановке бота.
+    # Отменяются только задачи, ждущие окна: уже начатая отправка дожидается завершения,
+    # так как ее правка уже убрана из _pending.
+    async def flush(self):
+        self._closing = True
+        tasks = list(self._tasks.values())
+        for key, task in list(self._tasks.items()):
+            if key not in self._sending:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        for key in list(self._pending):
+            await self._send(key)
+        self._closing = False
+
+    def stats(self):
+        return {'pending': len(self._pending), 'sent': self.sent, 'coalesced': self.coalesced, 'skipped': self.skipped}
@@ -0,0 +1,92 @@
+import csv
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import urllib.parse
+
+from database import DB_PATH
+
+EXPORT_CHUNK = int(os.getenv('EXPORT_CHUNK', '1000'))
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+EXPORT_COLUMNS = ('poll_id', 'option_id', 'option_text', 'user_id', 'user_name')
+# Порядок совпадает с индексом idx_votes_poll (poll_id, option_id, user_id, user_name): читаются только строки
+# опроса, уже отсортированные, без обхода всех голосов базы и без сортировки
+EXPORT_QUERY = '''SELECT votes.poll_id, votes.option_id, options.option_text, votes.user_id, votes.user_name
+                  FROM votes
+                  JOIN options ON options.id = votes.option_id
+                  WHERE votes.poll_id = ?
+                  ORDER BY votes.option_id, votes.user_id'''
+
+
+# Запись строк выгрузки (порциями) в файл csv или ndjson, возвращает число строк
+def write_rows(batches, path, fmt='csv'):
+    rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+        for batch in batches:
+            if fmt == 'csv':
+                writer.writerows(batch)
+            else:
+                f.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in batch)
+            rows += len(batch)
+    return rows
+
+
+# Выгрузка голосов опроса в файл. Курсор SQLite читает строки по мере обхода,
+# поэтому строки забираются порциями по EXPORT_CHUNK и память не зависит от размера опроса.
+def write_export(conn, poll_id, path, fmt='csv', chunk=EXPORT_CHUNK):
+    cursor = conn.execute(EXPORT_QUERY, (poll_id,))
+    return write_rows(iter(lambda: cursor.fetchmany(chunk), []), path, fmt)
+
+
+def export_filename(poll_id, fmt):
+    return f'poll_{poll_id}.{fmt}'
+
+
+# Выгрузка через хранилище опросов (см. poll_storage.py) во временный файл; удаляет файл вызывающий код
+async def export_poll(storage, poll_id, fmt='csv'):
+    fd, path = tempfile.mkstemp(suffix='.' + fmt, prefix=f'poll_{poll_id}_')
+    os.close(fd)
+    try:
+        rows = await storage.export(poll_id, path, fmt)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, rows
+
+
+# Разбор аргументов команды /export <poll_id> [csv|ndjson]; None при ошибке формата
+def parse_export_args(text):
+    parts = (text or '').split()[1:]
+    if not parts or not parts[0].isdigit():
+        return None
+    fmt = parts[1].lower() if len(parts) > 1 else 'csv'
+    if fmt not in EXPORT_FORMATS:
+        return None
+    return int(parts[0]), fmt
+
+
+# Выгрузка из командной строки: python export.py <poll_id> [csv|ndjson] [файл]
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Использование: python export.py <poll_id> [csv|ndjson] [файл]")
+        sys.exit(1)
+    poll_id = int(sys.argv[1])
+    fmt = sys.argv[2] if len(sys.argv) > 2 else 'csv'
+    if fmt not in EXPORT_FORMATS:
+        print(f"Неизвестный формат: {fmt}")
+        sys.exit(1)
+    path = sys.argv[3] if len(sys.argv) > 3 else export_filename(poll_id, fmt)
+
+    # Путь экранируется, как в Database._connect: символы ? и # в имени файла иначе попадут в параметры URI
+    conn = sqlite3.connect('file:' + urllib.parse.quote(os.path.abspath(DB_PATH)) + '?mode=ro', uri=True)
+    try:
+        rows = write_export(conn, poll_id, path, fmt)
+    finally:
+        conn.close()
+    print(f"{path}: {rows} строк")
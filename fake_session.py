@@ -0,0 +1,71 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Message
+
+# Сессия бота без сети: отвечает на запросы как Telegram API, записывает их в calls и
+# при превышении заданных лимитов возвращает 429 с retry_after, как настоящий сервер.
+# Используется для локальной проверки планировщика исходящих запросов и для нагрузочных тестов.
+
+
+class FakeSession(BaseSession):
+    def __init__(self, chat_limit=None, global_limit=None, retry_after=1, latency=0.0):
+        super().__init__()
+        self.chat_limit = chat_limit  # запросов в секунду на чат
+        self.global_limit = global_limit  # запросов в секунду на бота
+        self.retry_after = retry_after
+        self.latency = latency
+        self.calls = []
+        self.flood_errors = 0
+        self._message_ids = itertools.count(1)
+        self._global_sent = deque()
+        self._chat_sent = {}
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    def _over_limit(self, sent, limit, now):
+        while sent and now - sent[0] >= 1:
+            sent.popleft()
+        return limit is not None and len(sent) >= limit
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        now = time.monotonic()
+        chat_id = getattr(method, 'chat_id', None)
+        chat_sent = self._chat_sent.setdefault(chat_id, deque()) if chat_id is not None else None
+        if self._over_limit(self._global_sent, self.global_limit, now) or \
+                (chat_sent is not None and self._over_limit(chat_sent, self.chat_limit, now)):
+            self.flood_errors += 1
+            content = json.dumps({'ok': False, 'error_code': 429,
+                                  'description': f'Too Many Requests: retry after {self.retry_after}',
+                                  'parameters': {'retry_after': self.retry_after}})
+            return self.check_response(bot, method, 429, content)
+
+        self._global_sent.append(now)
+        if chat_sent is not None:
+            chat_sent.append(now)
+        self.calls.append(method)
+        content = json.dumps({'ok': True, 'result': self._result(method, chat_id)})
+        return self.check_response(bot, method, 200, content).result
+
+    def _result(self, method, chat_id):
+        returning = method.__returning__
+        if returning is bool:
+            return True
+        if returning is Message or 'Message' in str(returning):
+            return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                    'chat': {'id': chat_id if isinstance(chat_id, int) else 0, 'type': 'private'},
+                    'text': getattr(method, 'text', None)}
+        if 'List' in str(returning) or 'list' in str(returning):
+            return []
+        return {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'bot'}
@@ -1,13 +1,19 @@
-import json
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.storage.memory import MemoryStorage
-from datetime import datetime
 import asyncio
 from dotenv import load_dotenv
 import os
+import time
+
+from journal import Journal
+from metrics import Metrics
+from outbound import OutboundScheduler
+from poll_state import PollState
+from results_archive import ResultsArchive
+from webhook import run_bot
 
 load_dotenv()
 API_TOKEN = os.getenv('API_TOKEN')
@@ -16,37 +22,66 @@ RESULTS_FOLDER = 'poll_results'
 
 # Инициализация бота и диспетчера
 bot = Bot(token=API_TOKEN)
+outbound = OutboundScheduler()
+bot.session.middleware(outbound)  # Лимиты Telegram на отправку и повтор после 429
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+metrics = Metrics()
+metrics.setup(dp, bot)  # Задержки обработчиков и запросов Telegram API (/metrics)
 
-# Загружаем данные опросов из файла, если он существует
-if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, 'w') as f:
-        json.dump({}, f)
+# Глобальный идентификатор для активного опроса
+ACTIVE_POLL_KEY = "active_poll"
 
-with open(DATA_FILE, 'r') as f:
-    polls = json.load(f)
+# Данные опросов хранятся как снимок DATA_FILE и журнал изменений DATA_FILE.log
+journal = Journal(DATA_FILE)
+# Ответы завершивших опрос пользователей, по одной записи на пользователя
+archive = ResultsArchive(RESULTS_FOLDER)
 
 
-# Функция для сохранения данных опросов в файл
-def save_polls_data():
-    with open(DATA_FILE, 'w') as f:
-        json.dump(polls, f)
+# Применение изменения к данным опросов: при нажатии кнопки и при чтении журнала после перезапуска
+def apply_change(polls, change):
+    if change['op'] == 'create':
+        polls[ACTIVE_POLL_KEY] = PollState.from_dict(change['poll'])
+        return
 
+    poll_data = polls[ACTIVE_POLL_KEY]
+    if change['op'] == 'toggle':
+        index = poll_data.option_index(change['option'])
+        if index is not None:
+            poll_data.toggle(change['user'], index)
+    elif change['op'] == 'done':
+        poll_data.mark_answered(change['user'])
 
-# Глобальный идентификатор для активного опроса
-ACTIVE_POLL_KEY = "active_poll"
+
+# Преобразование данных опросов из JSON снимка и обратно
+def decode_polls(data):
+    return {key: PollState.from_dict(poll_data) for key, poll_data in data.items()}
+
+
+def encode_polls():
+    return {key: poll_data.to_dict() for key, poll_data in polls.items()}
+
+
+# Загружаем данные опросов: снимок и журнал изменений после него
+polls = journal.load(apply_change, decode=decode_polls)
+
+
+# Функция для сохранения изменения: применяем его и дописываем одну строку в журнал
+def save_change(change):
+    apply_change(polls, change)
+    journal.append(change)
 
 
 # Функция создания главного меню
 def create_main_menu():
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    buttons = [
-        KeyboardButton(text="Создать новый опрос"),
-        KeyboardButton(text="Запустить опрос"),
-        KeyboardButton(text="Показать результаты")
-    ]
-    keyboard.add(*buttons)
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="Создать новый опрос")],
+            [KeyboardButton(text="Запустить опрос")],
+            [KeyboardButton(text="Показать результаты")]
+        ],
+        resize_keyboard=True
+    )
     return keyboard
 
 
@@ -85,15 +120,9 @@ async def show_poll_results(message: Message):
     if not poll_data:
         await message.answer("Сейчас нет активного опроса.")
     else:
-        # Подсчет голосов
-        stats = {option: 0 for option in poll_data['options']}
-        for user_responses in poll_data['responses'].values():
-            for response in user_responses:
-                stats[response] += 1
-
-        # Формирование текста с результатами
-        stats_text = f"Статистика по опросу: {poll_data['question']}\n\n"
-        for option, count in stats.items():
+        # Формирование текста с результатами по счетчикам вариантов
+        stats_text = f"Статистика по опросу: {poll_data.question}\n\n"
+        for option, count in poll_data.results():
             stats_text += f"{option}: {count} голосов\n"
 
         await message.answer(stats_text)
@@ -113,15 +142,8 @@ async def create_poll_command(message: Message):
             return
 
         # Сохранение опроса
-        polls[ACTIVE_POLL_KEY] = {
-            "question": question,
-            "options": options,
-            "responses": {},  # Для хранения ответов пользователей
-            "answered_users": []  # Список пользователей, которые уже ответили
-        }
-
-        # Сохраняем данные в файл
-        save_polls_data()
+        poll_id = int(time.time() * 1000)
+        save_change({'op': 'create', 'poll': PollState(question, options, poll_id).to_dict()})
 
         await message.answer("Опрос создан! Используй кнопку 'Запустить опрос', чтобы начать.",
                              reply_markup=create_main_menu())
@@ -137,9 +159,8 @@ def create_poll_keyboard():
     poll_data = polls.get(ACTIVE_POLL_KEY)
 
     if poll_data:
-        options = poll_data['options']
-        for option in options:
-            keyboard_builder.add(InlineKeyboardButton(text=option, callback_data=option))
+        for index, option in enumerate(poll_data.options):
+            keyboard_builder.add(InlineKeyboardButton(text=option, callback_data=f'option:{index}'))
 
         # Кнопка завершения ответа
         keyboard_builder.add(InlineKeyboardButton(text="Готово", callback_data="done"))
@@ -152,7 +173,7 @@ async def send_poll(chat_id):
     poll_data = polls.get(ACTIVE_POLL_KEY)
 
     if poll_data:
-        question = poll_data["question"]
+        question = poll_data.question
         keyboard = create_poll_keyboard()
         await bot.send_message(chat_id, question, reply_markup=keyboard)
 
@@ -168,60 +189,65 @@ async def poll_response_handler(callback_query: types.CallbackQuery):
         return
 
     # Проверяем, ответил ли пользователь уже на этот опрос
-    if user_id in poll_data['answered_users']:
+    if poll_data.is_answered(user_id):
         await callback_query.answer("Вы уже ответили на этот опрос.")
         return
 
     if callback_query.data == "done":
         # Отправляем результаты выбранных вариантов пользователю
-        responses = poll_data['responses'].get(user_id, [])
+        responses = poll_data.selected_options(user_id)
         if not responses:
             await callback_query.answer("Вы не выбрали ни одного варианта.")
         else:
             await callback_query.message.answer(f"Ваши ответы: {', '.join(responses)}")
             # Добавляем пользователя в список тех, кто ответил
-            poll_data['answered_users'].append(user_id)
-
-            # Сохраняем результаты опроса
-            save_poll_results(poll_data)
+            save_change({'op': 'done', 'user': user_id})
 
-        # Сохраняем данные в файл
-        save_polls_data()
+            # Сохраняем ответ пользователя в архив результатов
+            archive.append(poll_data.poll_id, user_id, responses)
         return
 
-    # Сохраняем выбранные пользователем ответы
-    if user_id not in poll_data['responses']:
-        poll_data['responses'][user_id] = []
-
-    if callback_query.data in poll_data['responses'][user_id]:
-        # Если вариант уже выбран, убираем его из списка
-        poll_data['responses'][user_id].remove(callback_query.data)
+    # Кнопки старых сообщений содержат текст варианта вместо индекса
+    if callback_query.data.startswith('option:'):
+        try:
+            option = int(callback_query.data.split(':', 1)[1])
+        except ValueError:
+            await callback_query.answer()
+            return
     else:
-        # Добавляем выбранный вариант
-        poll_data['responses'][user_id].append(callback_query.data)
+        option = callback_query.data
+    if poll_data.option_index(option) is None:
+        await callback_query.answer()
+        return
+
+    # Сохраняем выбранный или снятый пользователем вариант
+    save_change({'op': 'toggle', 'user': user_id, 'option': option})
 
     # Обновляем сообщение с клавиатурой
-    await callback_query.message.edit_reply_markup(create_poll_keyboard())
+    await callback_query.message.edit_reply_markup(reply_markup=create_poll_keyboard())
+
 
-    # Сохраняем данные в файл
-    save_polls_data()
+compaction_task = None
 
 
-# Функция для сохранения результатов опроса в файл
-def save_poll_results(poll_data):
-    if not os.path.exists(RESULTS_FOLDER):
-        os.makedirs(RESULTS_FOLDER)
+# Фоновая запись снимков журнала
+async def start_compaction():
+    global compaction_task
+    compaction_task = asyncio.create_task(journal.run_compaction(encode_polls))
 
-    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    results_filename = os.path.join(RESULTS_FOLDER, f"poll_{timestamp}.json")
 
-    with open(results_filename, 'w') as f:
-        json.dump(poll_data, f)
+# При остановке записываем итоговый снимок
+async def shutdown():
+    compaction_task.cancel()
+    await journal.close(encode_polls)
+    archive.close()
 
 
 # Функция запуска бота
 async def main():
-    await dp.start_polling(bot)
+    dp.startup.register(start_compaction)
+    dp.shutdown.register(shutdown)
+    await run_bot(dp, bot, metrics=metrics)
 
 
 if __name__ == '__main__':
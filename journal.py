@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+
+JOURNAL_COMPACT_INTERVAL = float(os.getenv('JOURNAL_COMPACT_INTERVAL', '60'))
+JOURNAL_COMPACT_RECORDS = int(os.getenv('JOURNAL_COMPACT_RECORDS', '10000'))
+JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', '0') == '1'
+
+logger = logging.getLogger(__name__)
+
+
+def _write_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Журнал изменений со снимками: каждое изменение дописывается одной строкой в path.log,
+# периодически состояние целиком атомарно записывается в path (временный файл + rename).
+# При запуске читается снимок и поверх него применяются записи журнала, которых в снимке еще нет.
+class Journal:
+    def __init__(self, path, compact_records=JOURNAL_COMPACT_RECORDS, fsync=JOURNAL_FSYNC):
+        self.path = path
+        self.log_path = path + '.log'
+        self.rotated_path = path + '.log.1'
+        self.compact_records = compact_records
+        self.fsync = fsync
+        self.seq = 0
+        self.records = 0  # записей после последнего снимка
+        self._log = None
+        self._compaction = asyncio.Lock()
+
+    # Загружает снимок и применяет к нему журнал: apply(state, record);
+    # decode преобразует JSON снимка в объекты состояния до применения журнала
+    def load(self, apply, decode=None):
+        state = {}
+        snapshot_seq = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                snapshot = json.load(f)
+            # Файлы, записанные до появления журнала, содержат состояние без обертки
+            if isinstance(snapshot, dict) and set(snapshot) == {'seq', 'state'}:
+                snapshot_seq, state = snapshot['seq'], snapshot['state']
+            else:
+                state = snapshot
+        if decode is not None:
+            state = decode(state)
+
+        self.seq = snapshot_seq
+        for log_path in (self.rotated_path, self.log_path):
+            if not os.path.exists(log_path):
+                continue
+            with open(log_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная последняя строка после аварийной остановки
+                        logger.warning("Пропущена поврежденная запись журнала %s", log_path)
+                        break
+                    if record['seq'] <= snapshot_seq:
+                        continue
+                    apply(state, record['data'])
+                    self.seq = record['seq']
+                    self.records += 1
+
+        self._log = open(self.log_path, 'a')
+        return state
+
+    def append(self, data):
+        self.seq += 1
+        self._log.write(json.dumps({'seq': self.seq, 'data': data}) + '\n')
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self.records += 1
+
+    @property
+    def needs_compaction(self):
+        return self.records >= self.compact_records
+
+    # Записывает снимок состояния get_state(). Состояние, его seq и смена журнала берутся под блокировкой
+    # без await между ними, поэтому каждая запись попадает либо в снимок, либо в свежий журнал.
+    # Запись файла выполняется в отдельном потоке.
+    async def compact(self, get_state):
+        async with self._compaction:
+            if self.records == 0 and os.path.exists(self.path):
+                return
+
+            data = json.dumps({'seq': self.seq, 'state': get_state()})
+            self._rotate()
+            records, self.records = self.records, 0
+
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write_snapshot, data)
+            except Exception:
+                self.records += records
+                raise
+
+    def _rotate(self):
+        self._log.close()
+        if os.path.exists(self.rotated_path):
+            # Предыдущий снимок не был записан: дописываем журнал к уже отложенному
+            with open(self.log_path, 'r') as src, open(self.rotated_path, 'a') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, self.rotated_path)
+        self._log = open(self.log_path, 'a')
+
+    def _write_snapshot(self, data):
+        _write_atomic(self.path, data)
+        os.remove(self.rotated_path)
+
+    # Фоновое сжатие журнала: по таймеру или когда накопилось compact_records записей
+    async def run_compaction(self, get_state, interval=JOURNAL_COMPACT_INTERVAL):
+        waited = 0.0
+        step = min(1.0, interval)
+        while True:
+            await asyncio.sleep(step)
+            waited += step
+            if self.needs_compaction or (waited >= interval and self.records):
+                waited = 0.0
+                try:
+                    # shield: отмена фоновой задачи не прерывает уже начатую запись снимка
+                    await asyncio.shield(self.compact(get_state))
+                except Exception:
+                    logger.exception("Не удалось записать снимок %s", self.path)
+
+    async def close(self, get_state):
+        await self.compact(get_state)
+        self._log.close()
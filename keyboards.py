@@ -0,0 +1,72 @@
+import os
+from collections import OrderedDict
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from callback_codec import FINISH, RESULTS, VOTE, encode
+
+KEYBOARD_CACHE_SIZE = int(os.getenv('KEYBOARD_CACHE_SIZE', '4096'))
+
+
+# Неизменяемая часть клавиатуры опроса: для каждого варианта заранее созданы кнопки
+# с отметкой "✓" и без нее. Объекты aiogram заморожены, поэтому их можно переиспользовать.
+class PollKeyboardTemplate:
+    def __init__(self, poll_id, options):
+        self.options = options
+        self.bits = {option_id: 1 << index for index, (option_id, _) in enumerate(options)}
+        self.buttons = [
+            (InlineKeyboardButton(text=option_text, callback_data=encode(VOTE, poll_id, option_id)),
+             InlineKeyboardButton(text=f"✓ {option_text}", callback_data=encode(VOTE, poll_id, option_id)))
+            for option_id, option_text in options
+        ]
+        self.voting_row = [InlineKeyboardButton(text="Проголосовать", callback_data=encode(FINISH, poll_id))]
+        self.results_row = [InlineKeyboardButton(text="Посмотреть результаты", callback_data=encode(RESULTS, poll_id))]
+
+    # Битовая маска выбранных вариантов
+    def mask(self, selected_options):
+        mask = 0
+        for option_id in selected_options or ():
+            mask |= self.bits.get(option_id, 0)
+        return mask
+
+    def build(self, mask, is_voting=True):
+        rows = [[pair[(mask >> index) & 1]] for index, pair in enumerate(self.buttons)]
+        rows.append(self.voting_row if is_voting else self.results_row)
+        # Кнопки уже проверены при создании шаблона, повторная валидация не нужна
+        return InlineKeyboardMarkup.model_construct(inline_keyboard=rows)
+
+
+# Шаблоны клавиатур по опросам и кэш уже собранных вариантов для частых наборов выбранных вариантов
+class KeyboardTemplates:
+    def __init__(self, maxsize=KEYBOARD_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._templates = OrderedDict()
+        self._variants = OrderedDict()
+
+    def template(self, poll_id, options):
+        template = self._templates.get(poll_id)
+        if template is None or template.options != options:
+            template = self._templates[poll_id] = PollKeyboardTemplate(poll_id, options)
+            if len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        else:
+            self._templates.move_to_end(poll_id)
+        return template
+
+    def build(self, poll_id, options, selected_options=None, is_voting=True):
+        template = self.template(poll_id, options)
+        key = (poll_id, template.mask(selected_options), is_voting)
+
+        keyboard = self._variants.get(key)
+        if keyboard is None:
+            keyboard = self._variants[key] = template.build(key[1], is_voting)
+            if len(self._variants) > self.maxsize:
+                self._variants.popitem(last=False)
+        else:
+            self._variants.move_to_end(key)
+        return keyboard
+
+
+FINISH_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Голосование завершено", callback_data='voting_ended')]
+])
@@ -0,0 +1,112 @@
+import os
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+
+from callback_codec import VOTE, decode
+
+LOAD_SHED_DEADLINE = float(os.getenv('LOAD_SHED_DEADLINE', '10'))  # секунд от получения нажатия до обработки
+LOAD_SHED_MAX_INFLIGHT = int(os.getenv('LOAD_SHED_MAX_INFLIGHT', '5000'))
+
+
+# Ответ на отброшенное нажатие; у слишком старых нажатий Telegram уже не принимает ответ
+async def _answer(event, text=None):
+    try:
+        await event.answer(text)
+    except TelegramBadRequest:
+        pass
+
+
+class _Ticket:
+    __slots__ = ('received', 'key', 'cancelled')
+
+    def __init__(self, received, key):
+        self.received = received
+        self.key = key
+        self.cancelled = False
+
+
+# Сброс нагрузки для нажатий кнопок при наплыве.
+# intake (внешний middleware) принимает нажатие: при переполнении сразу отвечает и отбрасывает его,
+# а два ожидающих нажатия одного пользователя на один вариант взаимно отменяются — переключение
+# дважды не меняет голос, поэтому в базу и в сообщение попадает только итоговое состояние.
+# execution (внутренний middleware, регистрируется после KeyedSchedulerMiddleware) перед запуском
+# обработчика отбрасывает нажатия старше deadline: пользователь уже не ждет ответа.
+class LoadShedder:
+    def __init__(self, deadline=LOAD_SHED_DEADLINE, max_inflight=LOAD_SHED_MAX_INFLIGHT):
+        self.deadline = deadline
+        self.max_inflight = max_inflight
+        self.in_flight = 0
+        self._waiting = {}  # (пользователь, опрос, вариант) -> ожидающее нажатие
+        self.shed_overload = 0
+        self.shed_stale = 0
+        self.coalesced = 0
+        self.intake = _IntakeMiddleware(self)
+        self.execution = _ExecutionMiddleware(self)
+
+    def setup(self, observer):
+        observer.outer_middleware(self.intake)
+        observer.middleware(self.execution)
+
+    def stats(self):
+        return {'in_flight': self.in_flight, 'shed_overload': self.shed_overload,
+                'shed_stale': self.shed_stale, 'coalesced': self.coalesced}
+
+
+class _IntakeMiddleware(BaseMiddleware):
+    def __init__(self, shedder):
+        self.shedder = shedder
+
+    async def __call__(self, handler, event, data):
+        shedder = self.shedder
+        if shedder.in_flight >= shedder.max_inflight:
+            shedder.shed_overload += 1
+            await _answer(event, "Бот перегружен, попробуйте позже.")
+            return None
+
+        key = None
+        decoded = decode(event.data)
+        if decoded is not None and decoded[0] == VOTE:
+            key = (event.from_user.id,) + decoded[1]
+            waiting = shedder._waiting.pop(key, None)
+            if waiting is not None:
+                # Пара переключений одного варианта: отменяем ожидающее и не запускаем новое
+                waiting.cancelled = True
+                shedder.coalesced += 2
+                await _answer(event)
+                return None
+
+        ticket = _Ticket(time.monotonic(), key)
+        if key is not None:
+            shedder._waiting[key] = ticket
+        data['shed_ticket'] = ticket
+        shedder.in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            shedder.in_flight -= 1
+            if key is not None and shedder._waiting.get(key) is ticket:
+                del shedder._waiting[key]
+
+
+class _ExecutionMiddleware(BaseMiddleware):
+    def __init__(self, shedder):
+        self.shedder = shedder
+
+    async def __call__(self, handler, event, data):
+        ticket = data.get('shed_ticket')
+        if ticket is None:
+            return await handler(event, data)
+
+        # Нажатие начало выполняться, дальше его нельзя отменить парным
+        if ticket.key is not None and self.shedder._waiting.get(ticket.key) is ticket:
+            del self.shedder._waiting[ticket.key]
+        if ticket.cancelled:
+            await _answer(event)
+            return None
+        if time.monotonic() - ticket.received > self.shedder.deadline:
+            self.shedder.shed_stale += 1
+            await _answer(event, "Запрос устарел, нажмите еще раз.")
+            return None
+        return await handler(event, data)
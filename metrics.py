@@ -0,0 +1,244 @@
+import bisect
+import os
+import re
+import threading
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # 0 — отдельный HTTP сервер в режиме polling не запускается
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+
+# Границы корзин гистограмм в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+)', re.IGNORECASE)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Оценка квантиля по границе корзины
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+# Вид запроса для метрик: глагол и первая таблица, например select_votes
+def query_kind(query):
+    verb = query.split(None, 1)[0].lower() if query.strip() else 'empty'
+    match = _TABLE_RE.search(query)
+    return f'{verb}_{match.group(1).lower()}' if match else verb
+
+
+# Метрики бота: задержки обработчиков, число обновлений и ошибок, время запросов SQLite и Telegram API.
+# При METRICS_ENABLED=0 middleware и наблюдатель базы не регистрируются, поэтому накладных расходов нет.
+class Metrics:
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.started = time.time()
+        self.updates = {}  # тип обновления -> число
+        self.handlers = {}  # обработчик -> Histogram
+        self.errors = {}  # обработчик -> число ошибок
+        self.queries = {}  # вид запроса -> Histogram
+        self.query_rows = {}  # вид запроса -> число строк
+        self.requests = {}  # метод Telegram API -> Histogram
+        self.request_errors = {}
+        self.sources = {}  # имя -> функция stats() компонента бота
+        self._kinds = {}
+        self._lock = threading.Lock()  # запросы к базе наблюдаются из потоков Database
+
+    def setup(self, dp, bot=None, db=None):
+        if not self.enabled:
+            return
+        dp.update.outer_middleware(UpdateCounterMiddleware(self))
+        handler_middleware = HandlerMetricsMiddleware(self)
+        dp.message.middleware(handler_middleware)
+        dp.callback_query.middleware(handler_middleware)
+        if bot is not None:
+            bot.session.middleware(RequestMetricsMiddleware(self))
+        if db is not None:
+            db.observer = self.observe_query
+
+    # Счетчики компонентов (планировщик задач, сброс нагрузки): stats() возвращает словарь чисел
+    def register_stats(self, name, stats):
+        self.sources[name] = stats
+
+    def _histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram()
+        return histogram
+
+    def observe_handler(self, name, seconds, failed=False):
+        self._histogram(self.handlers, name).observe(seconds)
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    # Вызывается Database из потоков писателя и читателей
+    def observe_query(self, query, seconds, rows):
+        kind = self._kinds.get(query)
+        if kind is None:
+            kind = self._kinds[query] = query_kind(query) if ' ' in query else query
+        with self._lock:
+            self._histogram(self.queries, kind).observe(seconds)
+            self.query_rows[kind] = self.query_rows.get(kind, 0) + max(rows, 0)
+
+    def observe_request(self, method, seconds, failed=False):
+        self._histogram(self.requests, method).observe(seconds)
+        if failed:
+            self.request_errors[method] = self.request_errors.get(method, 0) + 1
+
+    # Метрики в текстовом формате Prometheus
+    def render(self):
+        lines = [
+            '# TYPE bot_uptime_seconds gauge',
+            f'bot_uptime_seconds {time.time() - self.started:.3f}',
+            '# TYPE bot_updates_total counter',
+        ]
+        lines += [f'bot_updates_total{{type="{kind}"}} {count}' for kind, count in sorted(self.updates.items())]
+        lines += _render_histograms('bot_handler_seconds', 'handler', self.handlers)
+        lines.append('# TYPE bot_handler_errors_total counter')
+        lines += [f'bot_handler_errors_total{{handler="{name}"}} {count}' for name, count in sorted(self.errors.items())]
+        with self._lock:
+            lines += _render_histograms('bot_db_query_seconds', 'kind', self.queries)
+            lines.append('# TYPE bot_db_query_rows_total counter')
+            lines += [f'bot_db_query_rows_total{{kind="{kind}"}} {rows}' for kind, rows in sorted(self.query_rows.items())]
+        lines += _render_histograms('bot_api_request_seconds', 'method', self.requests)
+        lines.append('# TYPE bot_api_request_errors_total counter')
+        lines += [f'bot_api_request_errors_total{{method="{name}"}} {count}'
+                  for name, count in sorted(self.request_errors.items())]
+        for name, stats in sorted(self.sources.items()):
+            for key, value in stats().items():
+                lines.append(f'# TYPE bot_{name}_{key} gauge')
+                lines.append(f'bot_{name}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+    # Короткая сводка для команды /stats
+    def summary(self, limit=15):
+        if not self.enabled:
+            return "Метрики отключены (METRICS_ENABLED=0)."
+        lines = [f"Обновлений: {sum(self.updates.values())}", "", "Обработчики (число, ср. мс, p99 мс, ошибки):"]
+        lines += [_summary_line(name, histogram, self.errors.get(name, 0))
+                  for name, histogram in _slowest(self.handlers, limit)]
+        with self._lock:
+            queries = _slowest(self.queries, limit)
+        lines += ["", "Запросы SQLite (число, ср. мс, p99 мс, строк):"]
+        lines += [_summary_line(kind, histogram, self.query_rows.get(kind, 0)) for kind, histogram in queries]
+        lines += ["", "Telegram API (число, ср. мс, p99 мс, ошибки):"]
+        lines += [_summary_line(name, histogram, self.request_errors.get(name, 0))
+                  for name, histogram in _slowest(self.requests, limit)]
+        if self.sources:
+            lines.append("")
+            lines += [f"{name}: " + ', '.join(f"{key}={value}" for key, value in stats().items())
+                      for name, stats in sorted(self.sources.items())]
+        return '\n'.join(lines)[:4000]
+
+
+def _slowest(table, limit):
+    return sorted(table.items(), key=lambda item: item[1].sum, reverse=True)[:limit]
+
+
+def _summary_line(name, histogram, extra):
+    average = histogram.sum / histogram.count * 1000 if histogram.count else 0.0
+    return f"{name}: {histogram.count}, {average:.1f}, {histogram.quantile(0.99) * 1000:g}, {extra}"
+
+
+def _render_histograms(metric, label, table):
+    lines = [f'# TYPE {metric} histogram']
+    for key, histogram in sorted(table.items()):
+        total = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            total += count
+            lines.append(f'{metric}_bucket{{{label}="{key}",le="{bound}"}} {total}')
+        lines.append(f'{metric}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{metric}_sum{{{label}="{key}"}} {histogram.sum:.6f}')
+        lines.append(f'{metric}_count{{{label}="{key}"}} {histogram.count}')
+    return lines
+
+
+# Считает входящие обновления по типу
+class UpdateCounterMiddleware(BaseMiddleware):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        kind = event.event_type
+        self.metrics.updates[kind] = self.metrics.updates.get(kind, 0) + 1
+        return await handler(event, data)
+
+
+# Задержка и ошибки по обработчикам; вызывается только для обновлений, у которых нашелся обработчик
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        # Для нажатий кнопок через CallbackRoutes учитывается обработчик из таблицы действий
+        handler_object = data.get('callback_handler') or data.get('handler')
+        if handler_object is None:
+            name = type(event).__name__
+        else:
+            name = getattr(handler_object, 'callback', handler_object).__name__
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            self.metrics.observe_handler(name, time.perf_counter() - started, failed=True)
+            raise
+        self.metrics.observe_handler(name, time.perf_counter() - started)
+        return result
+
+
+# Время запросов к Telegram API; регистрируется после планировщика исходящих запросов,
+# поэтому ожидание лимитов в измерение не входит, а каждая повторная попытка считается отдельно
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            result = await make_request(bot, method)
+        except Exception:
+            self.metrics.observe_request(name, time.perf_counter() - started, failed=True)
+            raise
+        self.metrics.observe_request(name, time.perf_counter() - started)
+        return result
+
+
+def add_metrics_route(app, metrics, path=METRICS_PATH):
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+    app.router.add_get(path, handle)
+
+
+# Отдельный HTTP сервер с /metrics для режима polling
+async def start_metrics_server(metrics, host=METRICS_HOST, port=METRICS_PORT):
+    app = web.Application()
+    add_metrics_route(app, metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,103 @@
+# Миграции схемы polls.db. Версия схемы хранится в PRAGMA user_version;
+# при запуске применяются только миграции новее текущей версии.
+
+
+# Базовая схема, общая для test_sqlite.py и bot_sqlite_group.py
+def _base_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS polls (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        question TEXT,
+                        active INTEGER
+                    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS options (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        poll_id INTEGER,
+                        option_text TEXT,
+                        FOREIGN KEY (poll_id) REFERENCES polls (id)
+                    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS votes (
+                        user_id INTEGER,
+                        user_name TEXT,
+                        poll_id INTEGER,
+                        option_id INTEGER,
+                        PRIMARY KEY (user_id, poll_id, option_id),
+                        FOREIGN KEY (poll_id) REFERENCES polls (id)
+                    )''')
+
+    # Базы test_sqlite.py создавались без колонки user_name
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(votes)")}
+    if 'user_name' not in columns:
+        conn.execute("ALTER TABLE votes ADD COLUMN user_name TEXT")
+
+
+# Счетчики голосов по вариантам (см. tallies.py)
+def _tallies(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS tallies (
+                        option_id INTEGER PRIMARY KEY,
+                        poll_id INTEGER,
+                        votes INTEGER NOT NULL DEFAULT 0,
+                        FOREIGN KEY (option_id) REFERENCES options (id)
+                    )''')
+    conn.execute('''INSERT OR IGNORE INTO tallies (option_id, poll_id, votes)
+                    SELECT options.id, options.poll_id, COUNT(votes.option_id)
+                    FROM options
+                    LEFT JOIN votes ON options.id = votes.option_id
+                    GROUP BY options.id''')
+
+
+# Индексы для клавиатуры опроса, результатов и поиска активного опроса
+def _indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_options_poll ON options (poll_id, id, option_text)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_votes_option ON votes (option_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_polls_active ON polls (active, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tallies_poll ON tallies (poll_id, option_id, votes)")
+
+
+# Срок автоматического завершения опроса (unix time, см. deadline_scheduler.py)
+def _deadlines(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(polls)")}
+    if 'closes_at' not in columns:
+        conn.execute("ALTER TABLE polls ADD COLUMN closes_at REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_polls_deadline ON polls (active, closes_at)")
+
+
+# Голоса одного опроса по порядку вариантов: загрузка опроса в память (poll_storage.py) и выгрузка
+def _votes_poll_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_votes_poll ON votes (poll_id, option_id, user_id, user_name)")
+
+
+MIGRATIONS = [
+    _base_schema,
+    _tallies,
+    _indexes,
+    _deadlines,
+    _votes_poll_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Обновляет базу до SCHEMA_VERSION; каждая миграция выполняется в своей транзакции
+def migrate(conn):
+    version = get_version(conn)
+    if version >= SCHEMA_VERSION:
+        return version
+
+    for number in range(version, SCHEMA_VERSION):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Несколько процессов (см. sharding.py) могут обновлять одну базу: миграцию уже применил другой
+            if get_version(conn) > number:
+                conn.rollback()
+                continue
+            MIGRATIONS[number](conn)
+            conn.execute(f"PRAGMA user_version = {number + 1}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    return SCHEMA_VERSION
@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery
+
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))  # запросов в секунду на бота
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))  # в секунду для личного чата
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', str(20 / 60)))  # в секунду для группы
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+OUTBOUND_CHAT_BUCKETS = int(os.getenv('OUTBOUND_CHAT_BUCKETS', '10000'))
+
+# Приоритеты: ответы на нажатия > правки сообщений > новые сообщения
+PRIORITY_ANSWER = 0
+PRIORITY_EDIT = 1
+PRIORITY_SEND = 2
+
+logger = logging.getLogger(__name__)
+
+
+def method_priority(method):
+    if isinstance(method, AnswerCallbackQuery):
+        return PRIORITY_ANSWER
+    name = type(method).__name__
+    if name.startswith(('Edit', 'Delete', 'Stop')):
+        return PRIORITY_EDIT
+    return PRIORITY_SEND
+
+
+# Ведро токенов: rate токенов в секунду, не больше capacity
+class TokenBucket:
+    def __init__(self, rate, capacity=1.0):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Сколько секунд ждать до появления токена
+    def delay(self, now):
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    # Блокирует ведро после ответа 429 с retry_after
+    def block(self, seconds):
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+    def idle(self, now):
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+# Планировщик исходящих запросов к Telegram API (middleware сессии бота).
+# Запросы в чаты проходят через общее ведро бота и ведро конкретного чата, ожидающие запросы
+# выдаются по приоритету. Ответы на нажатия не расходуют лимиты сообщений и отправляются сразу.
+# При ответе 429 запрос повторяется после retry_after.
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE,
+                 group_rate=OUTBOUND_GROUP_RATE, max_retries=OUTBOUND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.sent = 0
+        self.retries = 0
+        self.waited = 0.0
+        self._chat_buckets = {}
+        self._waiters = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= OUTBOUND_CHAT_BUCKETS:
+                self._prune_buckets()
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(self.chat_rate if is_private else self.group_rate)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    # Удаляет ведра чатов, которые давно не использовались (полные и не заблокированные)
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.idle(now)]:
+            del self._chat_buckets[chat_id]
+
+    async def __call__(self, make_request, bot, method):
+        priority = method_priority(method)
+        chat_id = getattr(method, 'chat_id', None)
+        scheduled = priority != PRIORITY_ANSWER and chat_id is not None
+
+        for attempt in itertools.count():
+            if scheduled:
+                await self._acquire(priority, chat_id)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning("Telegram просит подождать %s с для %s в чате %s",
+                               e.retry_after, type(method).__name__, chat_id)
+                if scheduled:
+                    self._chat_bucket(chat_id).block(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    async def _acquire(self, priority, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), chat_id, future, time.monotonic()))
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    # Выдает разрешения ожидающим запросам: самый приоритетный запрос, чей чат не упирается в лимит
+    async def _pump(self):
+        while self._waiters:
+            self._wakeup.clear()
+            now = time.monotonic()
+            wait = self.global_bucket.delay(now)
+            if wait == 0:
+                wait = self._grant_one(now)
+                if wait == 0:
+                    continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant_one(self, now):
+        deferred = []
+        wait = None
+        try:
+            while self._waiters:
+                entry = heapq.heappop(self._waiters)
+                priority, _, chat_id, future, queued_at = entry
+                if future.done():
+                    continue
+                bucket = self._chat_bucket(chat_id)
+                delay = bucket.delay(now)
+                if delay == 0:
+                    bucket.take(now)
+                    self.global_bucket.take(now)
+                    self.waited += now - queued_at
+                    future.set_result(None)
+                    return 0
+                deferred.append(entry)
+                wait = delay if wait is None else min(wait, delay)
+        finally:
+            for entry in deferred:
+                heapq.heappush(self._waiters, entry)
+        return wait if wait is not None else 0
+
+    def stats(self):
+        return {'queued': len(self._waiters), 'sent': self.sent, 'retries': self.retries,
+                'waited_seconds': round(self.waited, 3)}
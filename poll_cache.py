@@ -0,0 +1,64 @@
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+POLL_CACHE_SIZE = int(os.getenv('POLL_CACHE_SIZE', '1024'))
+# Время жизни записи в секундах; 0 — без ограничения. Нужно, когда базу меняют несколько процессов
+# (см. sharding.py) и сброс кэша в одном процессе не виден остальным.
+POLL_CACHE_TTL = float(os.getenv('POLL_CACHE_TTL', '0'))
+
+# Описание опроса: вопрос, варианты [(option_id, option_text)] в порядке создания, флаг активности
+# и срок автоматического завершения (unix time или None)
+PollDefinition = namedtuple('PollDefinition', ['poll_id', 'question', 'options', 'active', 'closes_at'],
+                            defaults=(None,))
+
+
+def _load_definition(conn, poll_id):
+    poll = conn.execute("SELECT question, active, closes_at FROM polls WHERE id = ?", (poll_id,)).fetchone()
+    if poll is None:
+        return None
+    options = conn.execute("SELECT id, option_text FROM options WHERE poll_id = ? ORDER BY id", (poll_id,)).fetchall()
+    question, active, closes_at = poll
+    return PollDefinition(poll_id, question, tuple(options), bool(active), closes_at)
+
+
+# LRU-кэш описаний опросов. Описание опроса не меняется после создания, поэтому сбрасывать
+# кэш нужно только при создании, запуске и завершении опросов.
+class PollCache:
+    def __init__(self, db, maxsize=POLL_CACHE_SIZE, ttl=POLL_CACHE_TTL):
+        self.db = db
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+
+    async def get(self, poll_id):
+        entry = self._entries.get(poll_id)
+        if entry is not None and (not self.ttl or time.monotonic() - entry[1] < self.ttl):
+            self._entries.move_to_end(poll_id)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        generation = self._generation
+        definition = await self.db.snapshot(_load_definition, poll_id)
+        # Не кэшируем результат, если во время загрузки кэш был сброшен
+        if definition is not None and generation == self._generation:
+            self._entries[poll_id] = (definition, time.monotonic())
+            self._entries.move_to_end(poll_id)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return definition
+
+    # Сбрасывает один опрос или весь кэш (poll_id=None)
+    def invalidate(self, poll_id=None):
+        self._generation += 1
+        if poll_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(poll_id, None)
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,82 @@
+# Состояние опроса gpt_bot.py: варианты хранятся по индексам, выбор пользователя — битовой маской,
+# ответившие пользователи — множеством, счетчики по вариантам обновляются при каждом переключении.
+class PollState:
+    def __init__(self, question, options, poll_id=0):
+        self.poll_id = poll_id  # ключ опроса в архиве результатов
+        self.question = question
+        self.options = list(options)
+        self.selections = {}  # user_id -> битовая маска выбранных вариантов
+        self.answered = set()
+        self.counts = [0] * len(self.options)
+
+    # Переключает вариант index для пользователя, возвращает новую маску
+    def toggle(self, user_id, index):
+        bit = 1 << index
+        mask = self.selections.get(user_id, 0) ^ bit
+        self.counts[index] += 1 if mask & bit else -1
+        if mask:
+            self.selections[user_id] = mask
+        else:
+            self.selections.pop(user_id, None)
+        return mask
+
+    def selected(self, user_id):
+        mask = self.selections.get(user_id, 0)
+        return [index for index in range(len(self.options)) if mask >> index & 1]
+
+    def selected_options(self, user_id):
+        return [self.options[index] for index in self.selected(user_id)]
+
+    def mark_answered(self, user_id):
+        self.answered.add(user_id)
+
+    def is_answered(self, user_id):
+        return user_id in self.answered
+
+    # Индекс варианта по индексу или тексту (старые записи и кнопки хранили текст варианта)
+    def option_index(self, option):
+        if isinstance(option, int):
+            return option if 0 <= option < len(self.options) else None
+        try:
+            return self.options.index(option)
+        except ValueError:
+            return None
+
+    def results(self):
+        return list(zip(self.options, self.counts))
+
+    def to_dict(self):
+        return {
+            'poll_id': self.poll_id,
+            'question': self.question,
+            'options': self.options,
+            'selections': {str(user_id): mask for user_id, mask in self.selections.items()},
+            'answered': sorted(self.answered),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        poll = cls(data['question'], data['options'], data.get('poll_id', 0))
+        if 'selections' in data:
+            selections = {int(user_id): mask for user_id, mask in data['selections'].items()}
+            answered = data['answered']
+        else:
+            # Старый формат: responses {user_id: [текст варианта]} и список answered_users
+            selections = {}
+            for user_id, responses in data.get('responses', {}).items():
+                mask = 0
+                for option in responses:
+                    index = poll.option_index(option)
+                    if index is not None:
+                        mask |= 1 << index
+                if mask:
+                    selections[int(user_id)] = mask
+            answered = data.get('answered_users', [])
+
+        poll.selections = selections
+        poll.answered = set(answered)
+        for mask in selections.values():
+            for index in range(len(poll.options)):
+                if mask >> index & 1:
+                    poll.counts[index] += 1
+        return poll
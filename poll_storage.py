@@ -0,0 +1,604 @@
+import asyncio
+import json
+import logging
+import os
+from itertools import groupby
+from typing import Protocol
+
+from database import Database
+from export import write_export, write_rows
+from journal import Journal
+from migrations import migrate
+from poll_cache import PollCache, PollDefinition
+from poll_state import PollState
+from tallies import TallyCache, apply_tally_deltas, insert_tallies
+from vote_queue import VoteWriteQueue
+
+POLL_STORAGE = os.getenv('POLL_STORAGE', 'tiered')  # tiered, sqlite, journal или memory
+POLL_JOURNAL_PATH = os.getenv('POLL_JOURNAL_PATH', 'polls_storage.json')
+TIER_FLUSH_INTERVAL = float(os.getenv('TIER_FLUSH_INTERVAL', '1'))  # секунд между записями голосов в базу
+TIER_FLUSH_SIZE = int(os.getenv('TIER_FLUSH_SIZE', '5000'))  # при стольких изменениях запись начинается сразу
+TIER_LOG_PATH = os.getenv('TIER_LOG_PATH')  # по умолчанию DB_PATH + '.hot.log'
+TIER_LOG_FSYNC = os.getenv('TIER_LOG_FSYNC', '0') == '1'
+
+logger = logging.getLogger(__name__)
+
+
+# Хранилище опросов, через которое работают обработчики test_sqlite.py и bot_sqlite_group.py.
+# Опросы и варианты получают целочисленные id (варианты — сквозные по всем опросам), поэтому
+# callback_data кнопок не зависит от выбранной реализации.
+class PollStorage(Protocol):
+    async def start(self): ...
+
+    # Создает опрос и возвращает его id; closes_at — срок автоматического завершения (unix time)
+    async def create_poll(self, question, options, active=False, closes_at=None): ...
+
+    # PollDefinition или None
+    async def get_poll(self, poll_id): ...
+
+    async def active_polls(self): ...
+
+    async def open_poll(self, poll_id, closes_at=None): ...
+
+    # Завершает опрос poll_id или все активные (poll_id=None), возвращает id завершенных
+    async def close_poll(self, poll_id=None): ...
+
+    # Переключает голос и возвращает множество выбранных пользователем вариантов
+    async def toggle_vote(self, user_id, poll_id, option_id, user_name=None): ...
+
+    async def get_selection(self, user_id, poll_id): ...
+
+    # {option_id: число голосов}
+    async def get_tallies(self, poll_id): ...
+
+    # [(poll_id, closes_at)] активных опросов со сроком завершения
+    async def pending_deadlines(self): ...
+
+    # [(вопрос, [(вариант, число голосов)])] по завершенным опросам
+    async def closed_results(self): ...
+
+    # Записывает голоса опроса в файл (см. export.py), возвращает число строк
+    async def export(self, poll_id, path, fmt='csv'): ...
+
+    def stats(self): ...
+
+    async def close(self): ...
+
+
+# Опрос в памяти: выбор пользователей и счетчики хранит PollState по индексам вариантов,
+# option_ids сопоставляет индексам id вариантов
+class _StoredPoll:
+    def __init__(self, poll_id, option_ids, state, active=False, names=None, closes_at=None):
+        self.poll_id = poll_id
+        self.state = state
+        self.active = active
+        self.closes_at = closes_at
+        self.names = names or {}  # user_id -> имя пользователя для выгрузки
+        self.options = tuple(zip(option_ids, state.options))
+        self._indexes = {option_id: index for index, option_id in enumerate(option_ids)}
+
+    @property
+    def definition(self):
+        return PollDefinition(self.poll_id, self.state.question, self.options, self.active, self.closes_at)
+
+    def option_index(self, option_id):
+        return self._indexes.get(option_id)
+
+    def option_ids(self, indexes):
+        return {self.options[index][0] for index in indexes}
+
+    def to_dict(self):
+        return dict(self.state.to_dict(), option_ids=[option_id for option_id, _ in self.options], active=self.active,
+                    closes_at=self.closes_at, names={str(user_id): name for user_id, name in self.names.items()})
+
+    @classmethod
+    def from_dict(cls, data):
+        names = {int(user_id): name for user_id, name in data.get('names', {}).items()}
+        return cls(data['poll_id'], data['option_ids'], PollState.from_dict(data), data['active'], names,
+                   data.get('closes_at'))
+
+
+# Хранилище в памяти процесса: самое быстрое, данные теряются при перезапуске.
+# Все изменения проходят через _record, поэтому JournalStorage достаточно дописывать их в журнал.
+class MemoryStorage:
+    def __init__(self):
+        self._polls = {}
+        self._next_poll = 1
+        self._next_option = 1
+
+    async def start(self):
+        pass
+
+    def _add(self, stored):
+        self._polls[stored.poll_id] = stored
+        self._next_poll = max(self._next_poll, stored.poll_id + 1)
+        self._next_option = max([self._next_option] + [option_id + 1 for option_id, _ in stored.options])
+
+    # Применение изменения: при вызове методов и при чтении журнала после перезапуска
+    def _apply(self, change):
+        op = change['op']
+        if op == 'create':
+            state = PollState(change['question'], change['options'], change['poll'])
+            option_ids = range(change['first_option'], change['first_option'] + len(change['options']))
+            self._add(_StoredPoll(change['poll'], option_ids, state, change['active'], closes_at=change.get('closes_at')))
+            return change['poll']
+
+        stored = self._polls[change['poll']]
+        if op == 'toggle':
+            if change.get('name'):
+                stored.names[change['user']] = change['name']
+            stored.state.toggle(change['user'], stored.option_index(change['option']))
+            return stored.option_ids(stored.state.selected(change['user']))
+        if op == 'active':
+            stored.active = change['active']
+            if stored.active:
+                stored.closes_at = change.get('closes_at')
+
+    def _record(self, change):
+        return self._apply(change)
+
+    async def create_poll(self, question, options, active=False, closes_at=None):
+        return self._record({'op': 'create', 'poll': self._next_poll, 'first_option': self._next_option,
+                             'question': question, 'options': list(options), 'active': active,
+                             'closes_at': closes_at})
+
+    async def get_poll(self, poll_id):
+        stored = self._polls.get(poll_id)
+        return stored.definition if stored else None
+
+    async def active_polls(self):
+        return [stored.definition for poll_id, stored in sorted(self._polls.items()) if stored.active]
+
+    async def open_poll(self, poll_id, closes_at=None):
+        if poll_id in self._polls:
+            self._record({'op': 'active', 'poll': poll_id, 'active': True, 'closes_at': closes_at})
+
+    async def close_poll(self, poll_id=None):
+        if poll_id is None:
+            poll_ids = [poll_id for poll_id, stored in sorted(self._polls.items()) if stored.active]
+        else:
+            poll_ids = [poll_id] if poll_id in self._polls else []
+        for poll_id in poll_ids:
+            self._record({'op': 'active', 'poll': poll_id, 'active': False})
+        return poll_ids
+
+    async def toggle_vote(self, user_id, poll_id, option_id, user_name=None):
+        stored = self._polls.get(poll_id)
+        if stored is None:
+            return set()
+        if stored.option_index(option_id) is None:
+            return stored.option_ids(stored.state.selected(user_id))
+        return self._record({'op': 'toggle', 'poll': poll_id, 'user': user_id, 'option': option_id,
+                             'name': user_name})
+
+    async def get_selection(self, user_id, poll_id):
+        stored = self._polls.get(poll_id)
+        return stored.option_ids(stored.state.selected(user_id)) if stored else set()
+
+    async def get_tallies(self, poll_id):
+        stored = self._polls.get(poll_id)
+        if stored is None:
+            return {}
+        return {option_id: count for (option_id, _), count in zip(stored.options, stored.state.counts)}
+
+    async def pending_deadlines(self):
+        return [(poll_id, stored.closes_at) for poll_id, stored in sorted(self._polls.items())
+                if stored.active and stored.closes_at is not None]
+
+    async def closed_results(self):
+        return [(stored.state.question, stored.state.results())
+                for poll_id, stored in sorted(self._polls.items()) if not stored.active]
+
+    async def export(self, poll_id, path, fmt='csv'):
+        stored = self._polls.get(poll_id)
+        rows = []
+        if stored is not None:
+            for user_id, mask in stored.state.selections.items():
+                for index, (option_id, text) in enumerate(stored.options):
+                    if mask >> index & 1:
+                        rows.append((poll_id, option_id, text, user_id, stored.names.get(user_id)))
+            rows.sort(key=lambda row: (row[1], row[3]))
+        # Строки собираются в цикле событий, файл пишется в отдельном потоке
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, write_rows, [rows] if rows else [], path, fmt)
+
+    def stats(self):
+        return {'polls': len(self._polls), 'votes': sum(sum(stored.state.counts) for stored in self._polls.values())}
+
+    async def close(self):
+        pass
+
+
+# Хранилище в памяти с журналом изменений и снимками на диске (как данные gpt_bot.py, см. journal.py)
+class JournalStorage(MemoryStorage):
+    def __init__(self, path=POLL_JOURNAL_PATH):
+        super().__init__()
+        self.journal = Journal(path)
+        self._compaction_task = None
+
+    async def start(self):
+        self.journal.load(lambda state, change: self._apply(change), decode=self._restore)
+        self._compaction_task = asyncio.create_task(self.journal.run_compaction(self._encode))
+
+    def _restore(self, data):
+        for poll_data in data.get('polls', []):
+            self._add(_StoredPoll.from_dict(poll_data))
+        return data
+
+    def _encode(self):
+        return {'polls': [stored.to_dict() for poll_id, stored in sorted(self._polls.items())]}
+
+    def _record(self, change):
+        result = self._apply(change)
+        self.journal.append(change)
+        return result
+
+    def stats(self):
+        return dict(super().stats(), journal_records=self.journal.records)
+
+    async def close(self):
+        if self._compaction_task is not None:
+            self._compaction_task.cancel()
+        await self.journal.close(self._encode)
+
+
+def _insert_poll(conn, question, options, active, closes_at):
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO polls (question, active, closes_at) VALUES (?, ?, ?)",
+                   (question, int(active), closes_at))
+    poll_id = cursor.lastrowid
+
+    option_ids = []
+    for option in options:
+        cursor.execute("INSERT INTO options (poll_id, option_text) VALUES (?, ?)", (poll_id, option))
+        option_ids.append(cursor.lastrowid)
+    insert_tallies(conn, poll_id, option_ids)
+    return poll_id
+
+
+def _close_polls(conn, poll_id):
+    if poll_id is None:
+        poll_ids = [poll_id for poll_id, in conn.execute("SELECT id FROM polls WHERE active = 1")]
+    else:
+        # Несуществующий опрос: как в MemoryStorage, ничего не завершено
+        cursor = conn.execute("UPDATE polls SET active = 0 WHERE id = ?", (poll_id,))
+        return [poll_id] if cursor.rowcount else []
+    conn.executemany("UPDATE polls SET active = 0 WHERE id = ?", [(poll_id,) for poll_id in poll_ids])
+    return poll_ids
+
+
+# Хранилище в SQLite (database.py): кэш описаний опросов, счетчики tallies в памяти
+# и групповая запись голосов через VoteWriteQueue
+class SQLiteStorage:
+    def __init__(self, db=None):
+        self.db = db or Database()
+        self.poll_cache = PollCache(self.db)
+        self.tallies = TallyCache(self.db)
+        self.vote_queue = VoteWriteQueue(self.db, self.tallies)
+        self._checkpoint_task = None  # периодический checkpoint WAL
+
+    # Применяем недостающие миграции
+    async def start(self):
+        await self.db.transaction(migrate)
+        self._checkpoint_task = asyncio.create_task(self.db.run_checkpoints())
+
+    async def create_poll(self, question, options, active=False, closes_at=None):
+        poll_id = await self.db.transaction(_insert_poll, question, options, active, closes_at)
+        self.poll_cache.invalidate(poll_id)
+        return poll_id
+
+    async def get_poll(self, poll_id):
+        return await self.poll_cache.get(poll_id)
+
+    async def active_polls(self):
+        rows = await self.db.fetch("SELECT id FROM polls WHERE active = 1 ORDER BY id")
+        polls = [await self.poll_cache.get(poll_id) for poll_id, in rows]
+        return [poll for poll in polls if poll is not None]
+
+    async def open_poll(self, poll_id, closes_at=None):
+        await self.db.execute("UPDATE polls SET active = 1, closes_at = ? WHERE id = ?", (closes_at, poll_id))
+        self.poll_cache.invalidate(poll_id)
+
+    async def close_poll(self, poll_id=None):
+        poll_ids = await self.db.transaction(_close_polls, poll_id)
+        for poll_id in poll_ids:
+            self.poll_cache.invalidate(poll_id)
+        return poll_ids
+
+    async def toggle_vote(self, user_id, poll_id, option_id, user_name=None):
+        return await self.vote_queue.toggle(user_id, poll_id, option_id, user_name)
+
+    async def get_selection(self, user_id, poll_id):
+        rows = await self.db.fetch("SELECT option_id FROM votes WHERE user_id = ? AND poll_id = ?", (user_id, poll_id))
+        return {option_id for option_id, in rows}
+
+    async def get_tallies(self, poll_id):
+        return await self.tallies.get(poll_id)
+
+    async def pending_deadlines(self):
+        return await self.db.fetch("SELECT id, closes_at FROM polls WHERE active = 1 AND closes_at IS NOT NULL")
+
+    # Счетчики всех завершенных опросов одним запросом
+    async def closed_results(self):
+        rows = await self.db.fetch("""
+            SELECT polls.id, polls.question, options.option_text, tallies.votes
+            FROM polls
+            JOIN options ON options.poll_id = polls.id
+            JOIN tallies ON tallies.option_id = options.id
+            WHERE polls.active = 0
+            ORDER BY polls.id, options.id
+        """)
+        return [(question, [(option, count) for _, _, option, count in poll_rows])
+                for (poll_id, question), poll_rows in groupby(rows, key=lambda row: row[:2])]
+
+    async def export(self, poll_id, path, fmt='csv'):
+        return await self.db.read(write_export, poll_id, path, fmt)
+
+    def stats(self):
+        return dict(self.db.stats(), cache_hits=self.poll_cache.hits, cache_misses=self.poll_cache.misses)
+
+    # Записываем накопленные голоса и закрываем базу данных
+    async def close(self):
+        await self.vote_queue.close()
+        if self._checkpoint_task is not None:
+            self._checkpoint_task.cancel()
+        self.db.close()
+
+
+# Записывает итоговое состояние голосов [(poll_id, user_id, option_id, выбран, имя)] и меняет счетчики
+# на число действительно добавленных и удаленных строк. Повторная запись тех же изменений ничего не меняет,
+# поэтому журнал горячего слоя можно применять после сбоя, не зная, какая его часть уже попала в базу.
+def _persist_votes(conn, changes):
+    deltas = {}
+    renamed = []
+    for poll_id, user_id, option_id, on, name in changes:
+        if on:
+            cursor = conn.execute("INSERT OR IGNORE INTO votes (user_id, user_name, poll_id, option_id) "
+                                  "VALUES (?, ?, ?, ?)", (user_id, name, poll_id, option_id))
+            if not cursor.rowcount:
+                renamed.append((name, user_id, poll_id, option_id))
+        else:
+            cursor = conn.execute("DELETE FROM votes WHERE user_id = ? AND poll_id = ? AND option_id = ?",
+                                  (user_id, poll_id, option_id))
+        if cursor.rowcount:
+            key = (poll_id, option_id)
+            deltas[key] = deltas.get(key, 0) + (1 if on else -1)
+    conn.executemany("UPDATE votes SET user_name = ? WHERE user_id = ? AND poll_id = ? AND option_id = ?", renamed)
+    apply_tally_deltas(conn, deltas)
+
+
+# Журнал изменений горячего слоя, еще не записанных в базу. Перед записью пакета журнал
+# переименовывается в path.1 и удаляется после коммита; если запись не удалась, следующий
+# журнал дописывается к path.1 (как в journal.py).
+class _HotLog:
+    def __init__(self, path, fsync=TIER_LOG_FSYNC):
+        self.path = path
+        self.pending_path = path + '.1'
+        self.fsync = fsync
+        self._file = None
+
+    # Итоговые изменения из обоих файлов, по одному на (опрос, пользователь, вариант)
+    def read(self):
+        changes = {}
+        for path in (self.pending_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        change = tuple(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Недописанная последняя строка после аварийной остановки
+                        logger.warning("Пропущена поврежденная запись журнала %s", path)
+                        break
+                    changes[change[:3]] = change
+        return list(changes.values())
+
+    # Удаляет прочитанные файлы и открывает пустой журнал
+    def reset(self):
+        for path in (self.pending_path, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._file = open(self.path, 'a')
+
+    def append(self, change):
+        self._file.write(json.dumps(change, ensure_ascii=False) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def rotate(self):
+        self._file.close()
+        if os.path.exists(self.pending_path):
+            with open(self.path, 'r') as src, open(self.pending_path, 'a') as dst:
+                dst.write(src.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.pending_path)
+        self._file = open(self.path, 'a')
+
+    def commit(self):
+        if os.path.exists(self.pending_path):
+            os.remove(self.pending_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+# Двухуровневое хранилище: активные опросы целиком (выбор пользователей и счетчики) держатся
+# в памяти, нажатие меняет только память и дописывает строку в журнал _HotLog, а в SQLite голоса
+# записываются пакетами раз в TIER_FLUSH_INTERVAL секунд. Завершенный опрос записывается в базу
+# и убирается из памяти, дальше его читает SQLiteStorage. При запуске журнал применяется к базе,
+# затем активные опросы загружаются в память. Рассчитано на один процесс (не для sharding.py).
+class TieredStorage(SQLiteStorage):
+    def __init__(self, db=None, log_path=TIER_LOG_PATH, flush_interval=TIER_FLUSH_INTERVAL,
+                 flush_size=TIER_FLUSH_SIZE):
+        super().__init__(db)
+        self.log = _HotLog(log_path or self.db.path + '.hot.log')
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._hot = {}  # poll_id -> _StoredPoll
+        self._dirty = {}  # (poll_id, user_id, option_id) -> изменение, еще не записанное в базу
+        self._promoting = {}  # poll_id -> asyncio.Event, пока опрос загружается в память
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._flusher = None
+        self.flushes = 0
+        self.persisted = 0
+        self.recovered = 0
+
+    async def start(self):
+        await super().start()
+        # Изменения, не дошедшие до базы перед аварийной остановкой
+        changes = self.log.read()
+        if changes:
+            await self.db.transaction(_persist_votes, changes)
+            self.recovered = len(changes)
+            logger.info("Восстановлено изменений голосов из журнала: %s", len(changes))
+        self.log.reset()
+        for poll in await super().active_polls():
+            await self._promote(poll.poll_id)
+        self._flusher = asyncio.create_task(self._run_flusher())
+
+    # Загружает активный опрос из базы в память. Пока идет загрузка, нажатия по опросу ждут ее окончания
+    # (см. toggle_vote): иначе голос, попавший в холодный слой после записи очереди, не вошел бы в выборку.
+    async def _promote(self, poll_id):
+        if poll_id in self._hot:
+            return
+        promoting = self._promoting.get(poll_id)
+        if promoting is not None:
+            await promoting.wait()
+            return
+        promoting = self._promoting[poll_id] = asyncio.Event()
+        try:
+            await self.vote_queue.close()  # голоса, принятые пока опрос был в холодном слое
+            poll = await self.poll_cache.get(poll_id)
+            if poll is None:
+                return
+            rows = await self.db.fetch("SELECT user_id, user_name, option_id FROM votes WHERE poll_id = ?",
+                                       (poll_id,))
+            stored = _StoredPoll(poll_id, [option_id for option_id, _ in poll.options],
+                                 PollState(poll.question, [text for _, text in poll.options], poll_id), True,
+                                 closes_at=poll.closes_at)
+            for user_id, user_name, option_id in rows:
+                index = stored.option_index(option_id)
+                if index is not None:
+                    stored.state.toggle(user_id, index)
+                    if user_name:
+                        stored.names[user_id] = user_name
+            self._hot.setdefault(poll_id, stored)
+        finally:
+            del self._promoting[poll_id]
+            promoting.set()
+
+    async def create_poll(self, question, options, active=False, closes_at=None):
+        poll_id = await super().create_poll(question, options, active, closes_at)
+        if active:
+            await self._promote(poll_id)
+        return poll_id
+
+    async def get_poll(self, poll_id):
+        stored = self._hot.get(poll_id)
+        return stored.definition if stored else await super().get_poll(poll_id)
+
+    async def open_poll(self, poll_id, closes_at=None):
+        await super().open_poll(poll_id, closes_at)
+        stored = self._hot.get(poll_id)
+        if stored is not None:
+            stored.closes_at = closes_at
+        else:
+            await self._promote(poll_id)
+
+    # Завершенные опросы переходят в холодный слой: их голоса записываются в базу
+    async def close_poll(self, poll_id=None):
+        poll_ids = await super().close_poll(poll_id)
+        demoted = [poll_id for poll_id in poll_ids if self._hot.pop(poll_id, None) is not None]
+        if demoted:
+            await self.flush()
+            for poll_id in demoted:
+                self.tallies.invalidate(poll_id)
+        return poll_ids
+
+    async def toggle_vote(self, user_id, poll_id, option_id, user_name=None):
+        if poll_id in self._promoting:
+            await self._promoting[poll_id].wait()
+        stored = self._hot.get(poll_id)
+        if stored is None:
+            return await super().toggle_vote(user_id, poll_id, option_id, user_name)
+        index = stored.option_index(option_id)
+        if index is None:
+            return stored.option_ids(stored.state.selected(user_id))
+
+        if user_name:
+            stored.names[user_id] = user_name
+        mask = stored.state.toggle(user_id, index)
+        change = (poll_id, user_id, option_id, bool(mask >> index & 1), stored.names.get(user_id))
+        self.log.append(change)
+        self._dirty[change[:3]] = change
+        if len(self._dirty) >= self.flush_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+        return stored.option_ids(stored.state.selected(user_id))
+
+    async def get_selection(self, user_id, poll_id):
+        stored = self._hot.get(poll_id)
+        if stored is None:
+            return await super().get_selection(user_id, poll_id)
+        return stored.option_ids(stored.state.selected(user_id))
+
+    async def get_tallies(self, poll_id):
+        stored = self._hot.get(poll_id)
+        if stored is None:
+            return await super().get_tallies(poll_id)
+        return {option_id: count for (option_id, _), count in zip(stored.options, stored.state.counts)}
+
+    async def export(self, poll_id, path, fmt='csv'):
+        if poll_id in self._hot:
+            await self.flush()
+        return await super().export(poll_id, path, fmt)
+
+    # Записывает накопленные изменения одной транзакцией; при ошибке они остаются в очереди и в журнале
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self.log.rotate()
+            try:
+                await self.db.transaction(_persist_votes, list(batch.values()))
+            except Exception:
+                for key, change in batch.items():
+                    self._dirty.setdefault(key, change)
+                raise
+            self.log.commit()
+            self.flushes += 1
+            self.persisted += len(batch)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # shield: отмена фоновой задачи не прерывает уже начатую запись
+                await asyncio.shield(self.flush())
+            except Exception:
+                logger.exception("Не удалось записать голоса в %s", self.db.path)
+
+    def stats(self):
+        return dict(super().stats(), hot_polls=len(self._hot), dirty=len(self._dirty), flushes=self.flushes,
+                    persisted=self.persisted, recovered=self.recovered)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await self.flush()
+        self.log.close()
+        await super().close()
+
+
+STORAGES = {'tiered': TieredStorage, 'sqlite': SQLiteStorage, 'journal': JournalStorage, 'memory': MemoryStorage}
+
+
+def create_storage(kind=POLL_STORAGE):
+    if kind not in STORAGES:
+        raise ValueError(f"Неизвестное хранилище опросов: {kind} (доступны: {', '.join(STORAGES)})")
+    return STORAGES[kind]()
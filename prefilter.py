@@ -0,0 +1,32 @@
+from aiogram import BaseMiddleware
+
+
+# Внешний фильтр сообщений: пропускает к обработчикам только команды, кнопки меню и сообщения
+# администраторов, остальное (обычная переписка в группе) отбрасывается до фильтров обработчиков.
+# Проверки — срез первого символа и поиск в множествах, поэтому отброшенное сообщение почти ничего не стоит.
+# Тексты сравниваются без учета регистра: обработчик "Отмена" принимает и "отмена", и "ОТМЕНА".
+class ChatterFilterMiddleware(BaseMiddleware):
+    def __init__(self, allowed_texts, admin_ids):
+        self.allowed_texts = frozenset(text.lower() for text in allowed_texts)
+        self.admin_ids = admin_ids
+        self.passed = 0
+        self.dropped = {}  # тип чата -> число отброшенных сообщений
+
+    def allows(self, message):
+        text = message.text
+        if text is None:
+            return False
+        if text[:1] == '/' or text.lower() in self.allowed_texts:
+            return True
+        return message.from_user is not None and message.from_user.id in self.admin_ids
+
+    async def __call__(self, handler, event, data):
+        if not self.allows(event):
+            chat_type = event.chat.type
+            self.dropped[chat_type] = self.dropped.get(chat_type, 0) + 1
+            return None
+        self.passed += 1
+        return await handler(event, data)
+
+    def stats(self):
+        return {'passed': self.passed, 'dropped': dict(self.dropped)}
@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG')  # файл журнала; без него профилирование выключено
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '50'))
+SLOW_QUERY_LOG_BYTES = int(os.getenv('SLOW_QUERY_LOG_BYTES', str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv('SLOW_QUERY_LOG_BACKUPS', '5'))
+
+# Для этих запросов план выполнения имеет смысл; PRAGMA, BEGIN и DDL пропускаются
+EXPLAIN_VERBS = ('select', 'insert', 'update', 'delete', 'replace', 'with')
+
+
+# Форма параметров без значений: типы и длина строк, для executemany — число наборов
+def params_shape(args, many=False):
+    if many:
+        return {'rows': len(args), 'first': params_shape(args[0]) if args else []}
+    shape = []
+    for value in args:
+        if isinstance(value, str):
+            shape.append(f'str({len(value)})')
+        else:
+            shape.append(type(value).__name__)
+    return shape
+
+
+# Журнал медленных запросов: каждая запись — JSON строка в файле с ротацией.
+# Запросы дольше threshold_ms записываются с формой параметров, а для каждого нового текста SQL
+# один раз сохраняется EXPLAIN QUERY PLAN, чтобы видеть полные просмотры таблиц votes и options.
+class QueryProfiler:
+    def __init__(self, path=SLOW_QUERY_LOG, threshold_ms=SLOW_QUERY_MS,
+                 max_bytes=SLOW_QUERY_LOG_BYTES, backups=SLOW_QUERY_LOG_BACKUPS):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.logger = logging.getLogger(f'{__name__}.{path}')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+        self._explained = set()
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        record['time'] = round(time.time(), 3)
+        self.logger.info(json.dumps(record, ensure_ascii=False))
+
+    # Вызывается после каждого выполненного запроса в потоке соединения conn
+    def record(self, conn, query, args, seconds, rows=None, many=False):
+        if seconds >= self.threshold:
+            self._write({'type': 'slow', 'sql': query, 'ms': round(seconds * 1000, 3),
+                         'params': params_shape(args, many), 'rows': rows if rows is None or rows >= 0 else None})
+
+        with self._lock:
+            if query in self._explained:
+                return
+            self._explained.add(query)
+        if query.lstrip().split(None, 1)[0].lower() not in EXPLAIN_VERBS:
+            return
+        if many:
+            if not args:
+                return
+            args = args[0]
+        try:
+            plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, args)]
+        except sqlite3.Error as e:
+            plan = [f'ошибка: {e}']
+        self._write({'type': 'plan', 'sql': query, 'plan': plan})
+
+    def close(self):
+        for handler in self.logger.handlers[:]:
+            handler.close()
+            self.logger.removeHandler(handler)
+
+
+class ProfiledCursor:
+    def __init__(self, cursor, conn, profiler):
+        self._cursor = cursor
+        self._conn = conn
+        self._profiler = profiler
+
+    def execute(self, query, args=()):
+        started = time.perf_counter()
+        self._cursor.execute(query, args)
+        self._profiler.record(self._conn, query, args, time.perf_counter() - started, self._cursor.rowcount)
+        return self
+
+    def executemany(self, query, seq_of_args):
+        seq_of_args = list(seq_of_args)
+        started = time.perf_counter()
+        self._cursor.executemany(query, seq_of_args)
+        self._profiler.record(self._conn, query, seq_of_args, time.perf_counter() - started,
+                              self._cursor.rowcount, many=True)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# Соединение, которое передается функциям Database.transaction и Database.read при включенном профилировании
+class ProfiledConnection:
+    def __init__(self, conn, profiler):
+        self._conn = conn
+        self._profiler = profiler
+
+    def cursor(self):
+        return ProfiledCursor(self._conn.cursor(), self._conn, self._profiler)
+
+    def execute(self, query, args=()):
+        return self.cursor().execute(query, args)
+
+    def executemany(self, query, seq_of_args):
+        return self.cursor().executemany(query, seq_of_args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _read_records(path, backups=SLOW_QUERY_LOG_BACKUPS):
+    paths = [f'{path}.{number}' for number in range(backups, 0, -1)] + [path]
+    for log_path in paths:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+# Сводка журнала: самые долгие запросы по суммарному времени и планы с просмотром таблиц
+def report(path=SLOW_QUERY_LOG, limit=20):
+    slow = {}
+    plans = {}
+    for record in _read_records(path):
+        if record['type'] == 'slow':
+            stats = slow.setdefault(record['sql'], {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += record['ms']
+            stats['max_ms'] = max(stats['max_ms'], record['ms'])
+        elif record['type'] == 'plan':
+            plans[record['sql']] = record['plan']
+
+    lines = [f"Медленные запросы ({len(slow)}): число, всего мс, макс мс"]
+    for sql, stats in sorted(slow.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:limit]:
+        lines.append(f"{stats['count']:>7} {stats['total_ms']:>10.1f} {stats['max_ms']:>8.1f}  {' '.join(sql.split())}")
+
+    scans = {sql: plan for sql, plan in plans.items()
+             if any(step.startswith('SCAN') and 'USING' not in step for step in plan)}
+    lines += ["", f"Полный просмотр таблицы ({len(scans)} из {len(plans)} запросов):"]
+    for sql, plan in scans.items():
+        lines.append(' '.join(sql.split()))
+        lines += [f"    {step}" for step in plan]
+    return '\n'.join(lines)
+
+
+# Сводка журнала медленных запросов: python profiling.py [файл]
+if __name__ == '__main__':
+    log_path = sys.argv[1] if len(sys.argv) > 1 else SLOW_QUERY_LOG
+    if not log_path:
+        print("Использование: python profiling.py <файл журнала> (или задайте SLOW_QUERY_LOG)")
+        sys.exit(1)
+    print(report(log_path))
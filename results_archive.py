@@ -0,0 +1,134 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+
+RESULTS_FOLDER = os.getenv('RESULTS_FOLDER', 'poll_results')
+ARCHIVE_SEGMENT_SIZE = int(os.getenv('ARCHIVE_SEGMENT_SIZE', str(4 * 1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+
+# Архив результатов опросов: одна запись на ответившего пользователя.
+# Записи дописываются в сжатые сегменты segment-NNNNNN.gz, каждая отдельным gzip-блоком,
+# поэтому запись читается по смещению без распаковки всего сегмента. Файл index.ndjson
+# хранит для каждой записи опрос, сегмент, смещение и длину; индекс читается при первом обращении.
+class ResultsArchive:
+    def __init__(self, folder=RESULTS_FOLDER, segment_size=ARCHIVE_SEGMENT_SIZE):
+        self.folder = folder
+        self.segment_size = segment_size
+        self.index_path = os.path.join(folder, 'index.ndjson')
+        self._index = None  # poll_id -> [(сегмент, смещение, длина)]
+        self._segment = None
+        self._segment_name = None
+        self._index_file = None
+
+    def _segment_path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _load_index(self):
+        index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная последняя строка после аварийной остановки
+                        logger.warning("Пропущена поврежденная запись индекса %s", self.index_path)
+                        break
+                    index.setdefault(entry['poll'], []).append((entry['segment'], entry['offset'], entry['length']))
+        self._index = index
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._load_index()
+        return self._index
+
+    def _open_segment(self):
+        os.makedirs(self.folder, exist_ok=True)
+        segments = sorted(glob.glob(os.path.join(self.folder, 'segment-*.gz')))
+        if segments and os.path.getsize(segments[-1]) < self.segment_size:
+            self._segment_name = os.path.basename(segments[-1])
+        else:
+            number = int(os.path.basename(segments[-1])[8:14]) + 1 if segments else 1
+            self._segment_name = f'segment-{number:06d}.gz'
+        self._segment = open(self._segment_path(self._segment_name), 'ab')
+
+    # Дописывает ответ пользователя; сегмент сменяется после достижения segment_size байт
+    def append(self, poll_id, user_id, options):
+        if self._segment is None or self._segment.tell() >= self.segment_size:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            self._open_segment()
+        if self._index_file is None:
+            self._index_file = open(self.index_path, 'a')
+
+        record = {'poll': poll_id, 'user': user_id, 'options': options, 'time': int(time.time())}
+        data = gzip.compress((json.dumps(record, ensure_ascii=False) + '\n').encode())
+        offset = self._segment.tell()
+        self._segment.write(data)
+        self._segment.flush()
+
+        entry = {'poll': poll_id, 'segment': self._segment_name, 'offset': offset, 'length': len(data)}
+        self._index_file.write(json.dumps(entry) + '\n')
+        self._index_file.flush()
+        if self._index is not None:
+            self._index.setdefault(poll_id, []).append((self._segment_name, offset, len(data)))
+
+    # Читает записи опроса по индексу, не трогая остальные сегменты и записи
+    def load(self, poll_id):
+        records = []
+        entries = self.index.get(poll_id, [])
+        files = {}
+        try:
+            for segment, offset, length in entries:
+                f = files.get(segment)
+                if f is None:
+                    f = files[segment] = open(self._segment_path(segment), 'rb')
+                f.seek(offset)
+                records.append(json.loads(zlib.decompress(f.read(length), wbits=31)))
+        finally:
+            for f in files.values():
+                f.close()
+        return records
+
+    # Итоги опроса: число ответивших и количество голосов по вариантам
+    def summary(self, poll_id):
+        counts = {}
+        records = self.load(poll_id)
+        for record in records:
+            for option in record['options']:
+                counts[option] = counts.get(option, 0) + 1
+        return len(records), counts
+
+    def polls(self):
+        return list(self.index)
+
+    def close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+
+# Просмотр архива: python results_archive.py [poll_id]
+if __name__ == '__main__':
+    archive = ResultsArchive()
+    if len(sys.argv) < 2:
+        for poll_id in archive.polls():
+            print(poll_id, len(archive.index[poll_id]))
+    else:
+        poll_id = int(sys.argv[1])
+        answered, counts = archive.summary(poll_id)
+        print(f"Ответили: {answered}")
+        for option, count in counts.items():
+            print(f"{option}: {count}")
@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+from callback_codec import decode
+
+# Режим нескольких процессов для test_sqlite.py и bot_sqlite_group.py.
+# Фронтальный процесс принимает обновления (вебхук или записанный файл) и раздает их N процессам-обработчикам
+# через multiprocessing.Queue. Нажатия кнопок распределяются по poll_id, поэтому очередь записи голосов,
+# счетчики и объединение правок опроса живут в одном процессе; сообщения распределяются по chat_id.
+# Процессы работают с одной базой SQLite в режиме WAL; кэш опросов в них живет не дольше POLL_CACHE_TTL.
+#
+# python sharding.py serve test_sqlite --workers 4
+# python sharding.py replay test_sqlite updates.ndjson --workers 4
+
+SHARD_BOTS = ('test_sqlite', 'bot_sqlite_group')
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', str(os.cpu_count() or 1)))
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '10000'))
+SHARD_IN_FLIGHT = int(os.getenv('SHARD_IN_FLIGHT', '1000'))  # обновлений в обработке на процесс
+SHARD_POLL_CACHE_TTL = os.getenv('SHARD_POLL_CACHE_TTL', '2')
+SHARD_RECORD = os.getenv('SHARD_RECORD')  # файл для записи принятых вебхуком обновлений
+SHARD_STATS_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+# Ключ распределения обновления: ('poll', id) для кнопок опроса, иначе ('chat', id) или ('user', id)
+def shard_key(update):
+    callback = update.get('callback_query')
+    if callback is not None:
+        decoded = decode(callback.get('data'))
+        if decoded is not None and decoded[1]:
+            return 'poll', decoded[1][0]
+        message = callback.get('message')
+        if message is not None:
+            return 'chat', message['chat']['id']
+        return 'user', callback['from']['id']
+    for value in update.values():
+        if isinstance(value, dict):
+            if 'chat' in value:
+                return 'chat', value['chat']['id']
+            if 'from' in value:
+                return 'user', value['from']['id']
+    return 'update', update.get('update_id', 0)
+
+
+def shard_for(update, workers):
+    return shard_key(update)[1] % workers
+
+
+# Процесс-обработчик: импортирует модуль бота и подает ему обновления своей доли
+def worker_main(bot_name, shard, updates, stats, env):
+    os.environ.update(env)
+    asyncio.run(_worker(bot_name, shard, updates, stats, env.get('SHARD_FAKE_SESSION') == '1'))
+
+
+async def _worker(bot_name, shard, updates, stats, fake_session):
+    module = importlib.import_module(bot_name)
+    bot, dp = module.bot, module.dp
+    if fake_session:
+        from fake_session import FakeSession
+        # Модуль бота уже зарегистрировал на сессии лимиты отправки и метрики запросов — переносим их
+        session = FakeSession()
+        for middleware in bot.session.middleware:
+            session.middleware(middleware)
+        bot.session = session
+    await module.init_db()
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(SHARD_IN_FLIGHT)
+    tasks = set()
+    counters = {'shard': shard, 'processed': 0, 'errors': 0}
+
+    async def handle(update):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            counters['errors'] += 1
+            logger.exception("Ошибка обработки обновления в процессе %s", shard)
+        finally:
+            counters['processed'] += 1
+            slots.release()
+
+    def report(final=False):
+        stats.put(dict(counters, in_flight=len(tasks), updates=dict(module.metrics.updates),
+                       tasks=module.task_scheduler.stats(), final=final))
+
+    reported = time.monotonic()
+    while True:
+        update = await loop.run_in_executor(None, updates.get)
+        if update is None:
+            break
+        await slots.acquire()
+        task = asyncio.create_task(handle(update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        if time.monotonic() - reported >= SHARD_STATS_INTERVAL:
+            report()
+            reported = time.monotonic()
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    await module.shutdown()
+    await bot.session.close()
+    report(final=True)
+
+
+# Группа процессов-обработчиков и сводка их счетчиков
+class ShardPool:
+    def __init__(self, bot_name, workers=SHARD_WORKERS, fake_session=False):
+        self.bot_name = bot_name
+        self.workers = workers
+        context = multiprocessing.get_context('spawn')
+        self.stats_queue = context.Queue()
+        self.queues = [context.Queue(SHARD_QUEUE_SIZE) for _ in range(workers)]
+        env = {
+            # Горячий слой TieredStorage держит опросы в памяти одного процесса
+            'POLL_STORAGE': 'sqlite',
+            'POLL_CACHE_TTL': SHARD_POLL_CACHE_TTL,
+            # Лимит Telegram на бота делится между процессами
+            'OUTBOUND_GLOBAL_RATE': str(float(os.getenv('OUTBOUND_GLOBAL_RATE', '30')) / workers),
+            'SHARD_FAKE_SESSION': '1' if fake_session else '0',
+        }
+        self.processes = [
+            context.Process(target=worker_main, args=(bot_name, shard, self.queues[shard], self.stats_queue,
+                                                      dict(env, SHARD_ID=str(shard))),
+                            name=f'{bot_name}-shard-{shard}')
+            for shard in range(workers)
+        ]
+        self.shard_stats = {}
+        self.dispatched = [0] * workers
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    # Передает обновление процессу его доли; при заполненной очереди ждет (обратное давление)
+    def dispatch(self, update):
+        shard = shard_for(update, self.workers)
+        self.queues[shard].put(update)
+        self.dispatched[shard] += 1
+
+    def collect(self):
+        while True:
+            try:
+                stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.shard_stats[stats['shard']] = stats
+
+    # Сумма счетчиков по всем процессам
+    def summary(self):
+        self.collect()
+        shards = [self.shard_stats.get(shard, {'shard': shard}) for shard in range(self.workers)]
+        for shard in shards:
+            shard['dispatched'] = self.dispatched[shard['shard']]
+        updates = {}
+        for shard in shards:
+            for kind, count in shard.get('updates', {}).items():
+                updates[kind] = updates.get(kind, 0) + count
+        return {
+            'bot': self.bot_name,
+            'workers': self.workers,
+            'dispatched': sum(self.dispatched),
+            'processed': sum(shard.get('processed', 0) for shard in shards),
+            'errors': sum(shard.get('errors', 0) for shard in shards),
+            'updates': updates,
+            'shards': shards,
+        }
+
+    # Останавливает процессы после обработки уже переданных обновлений
+    def stop(self):
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            while process.is_alive():
+                self.collect()
+                process.join(0.1)
+        self.collect()
+
+
+# Воспроизведение записанных обновлений (по одному JSON на строку) без сети
+def replay(bot_name, path, workers):
+    pool = ShardPool(bot_name, workers, fake_session=True)
+    pool.start()
+    started = time.perf_counter()
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                pool.dispatch(json.loads(line))
+    pool.stop()
+    elapsed = time.perf_counter() - started
+    result = pool.summary()
+    result['seconds'] = round(elapsed, 3)
+    result['updates_per_sec'] = round(result['processed'] / elapsed, 1) if elapsed else 0.0
+    return result
+
+
+# Фронтальный процесс с вебхуком: принимает обновление, отвечает 200 и передает его процессу доли
+async def serve(bot_name, workers):
+    from aiogram import Bot
+    from aiohttp import web
+
+    from webhook import WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL
+
+    pool = ShardPool(bot_name, workers)
+    pool.start()
+    loop = asyncio.get_running_loop()
+    record = open(SHARD_RECORD, 'a') if SHARD_RECORD else None
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        update = await request.json()
+        if record is not None:
+            record.write(json.dumps(update, ensure_ascii=False) + '\n')
+        # put может ждать места в очереди процесса, поэтому выполняется вне цикла событий
+        await loop.run_in_executor(None, pool.dispatch, update)
+        return web.Response()
+
+    async def handle_shards(request):
+        return web.json_response(pool.summary())
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get('/shards', handle_shards)
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    bot = Bot(token=os.getenv('API_TOKEN'))
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+        logger.info("Вебхук %s:%s%s, процессов: %s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, workers)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await loop.run_in_executor(None, pool.stop)
+        await bot.session.close()
+        if record is not None:
+            record.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Запуск бота несколькими процессами")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="вебхук и процессы-обработчики")
+    serve_parser.add_argument('bot', choices=SHARD_BOTS)
+    serve_parser.add_argument('--workers', type=int, default=SHARD_WORKERS)
+    replay_parser = commands.add_parser('replay', help="воспроизвести записанные обновления без сети")
+    replay_parser.add_argument('bot', choices=SHARD_BOTS)
+    replay_parser.add_argument('updates')
+    replay_parser.add_argument('--workers', type=int, default=SHARD_WORKERS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.command == 'serve':
+        asyncio.run(serve(args.bot, args.workers))
+    else:
+        print(json.dumps(replay(args.bot, args.updates, args.workers), indent=2, ensure_ascii=False))
@@ -0,0 +1,43 @@
+# Создает нулевые счетчики для вариантов нового опроса (внутри транзакции создания опроса)
+def insert_tallies(conn, poll_id, option_ids):
+    conn.executemany("INSERT INTO tallies (option_id, poll_id, votes) VALUES (?, ?, 0)",
+                     [(option_id, poll_id) for option_id in option_ids])
+
+
+# Применяет накопленные изменения счетчиков {(poll_id, option_id): delta} внутри транзакции
+def apply_tally_deltas(conn, deltas):
+    conn.executemany("UPDATE tallies SET votes = votes + ? WHERE option_id = ?",
+                     [(delta, option_id) for (poll_id, option_id), delta in deltas.items() if delta])
+
+
+def _load_counts(conn, poll_id):
+    rows = conn.execute("SELECT option_id, votes FROM tallies WHERE poll_id = ?", (poll_id,))
+    return dict(rows.fetchall())
+
+
+# Копия таблицы tallies в памяти: {poll_id: {option_id: votes}}.
+# Загрузка идет через поток писателя, поэтому она упорядочена с записью пакетов голосов.
+class TallyCache:
+    def __init__(self, db):
+        self.db = db
+        self._counts = {}
+
+    async def get(self, poll_id):
+        counts = self._counts.get(poll_id)
+        if counts is None:
+            counts = await self.db.transaction(_load_counts, poll_id)
+            counts = self._counts.setdefault(poll_id, counts)
+        return counts
+
+    # Вызывается очередью записи после успешного коммита пакета
+    def apply(self, deltas):
+        for (poll_id, option_id), delta in deltas.items():
+            counts = self._counts.get(poll_id)
+            if counts is not None:
+                counts[option_id] = counts.get(option_id, 0) + delta
+
+    def invalidate(self, poll_id=None):
+        if poll_id is None:
+            self._counts.clear()
+        else:
+            self._counts.pop(poll_id, None)
@@ -0,0 +1,103 @@
+import asyncio
+import os
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+
+TASK_CONCURRENCY = int(os.getenv('TASK_CONCURRENCY', '64'))  # одновременно выполняемых обработчиков
+TASK_MAX_PENDING = int(os.getenv('TASK_MAX_PENDING', '10000'))  # после этого новые задачи ждут
+TASK_MAX_PER_KEY = int(os.getenv('TASK_MAX_PER_KEY', '16'))  # очередь одного ключа, лишнее отклоняется
+
+
+# Планировщик задач с упорядочиванием по ключу: задачи с одним ключом выполняются строго
+# по очереди в порядке поступления, с разными ключами — параллельно, но не больше concurrency сразу.
+# Когда задач в очередях больше max_pending, новые ждут освобождения места (обратное давление);
+# если у одного ключа набралось max_per_key задач, следующие отклоняются.
+class KeyedScheduler:
+    def __init__(self, concurrency=TASK_CONCURRENCY, max_pending=TASK_MAX_PENDING, max_per_key=TASK_MAX_PER_KEY):
+        self.max_pending = max_pending
+        self.max_per_key = max_per_key
+        self._slots = asyncio.Semaphore(concurrency)
+        self._keys = {}  # ключ -> [asyncio.Lock, число задач]
+        self._space = asyncio.Condition()
+        self._waiting = 0  # задач, ожидающих места в очередях
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    # Выполняет func(*args) в очереди ключа; возвращает (True, результат) или (False, None) при отклонении
+    async def run(self, key, func, *args):
+        entry = self._keys.get(key)
+        if entry is not None and entry[1] >= self.max_per_key:
+            self.rejected += 1
+            return False, None
+
+        if self.pending >= self.max_pending:
+            self.throttled += 1
+            self._waiting += 1
+            try:
+                async with self._space:
+                    await self._space.wait_for(lambda: self.pending < self.max_pending)
+            finally:
+                self._waiting -= 1
+            # Пока задача ждала места, очередь ключа могла заполниться
+            entry = self._keys.get(key)
+            if entry is not None and entry[1] >= self.max_per_key:
+                self.rejected += 1
+                # Освободившееся место достается следующей ожидающей задаче
+                if self._waiting:
+                    async with self._space:
+                        self._space.notify()
+                return False, None
+
+        if entry is None:
+            entry = self._keys[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.pending += 1
+        try:
+            # Сначала очередь ключа, затем общий слот: ожидающие своей очереди не занимают слоты
+            async with entry[0]:
+                async with self._slots:
+                    return True, await func(*args)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._keys[key]
+            self.pending -= 1
+            self.completed += 1
+            if self._waiting and self.pending < self.max_pending:
+                async with self._space:
+                    self._space.notify()
+
+    def stats(self):
+        return {'pending': self.pending, 'keys': len(self._keys), 'completed': self.completed,
+                'rejected': self.rejected, 'throttled': self.throttled}
+
+
+# Ключ для нажатия кнопки: пользователь и опрос из разобранной callback_data,
+# для прочих кнопок — сообщение, к которому они относятся
+def callback_key(event, data):
+    ids = data.get('callback_ids')
+    if ids:
+        return 'poll', event.from_user.id, ids[0]
+    if event.message is not None:
+        return 'message', event.message.chat.id, event.message.message_id
+    return 'user', event.from_user.id
+
+
+# Выполняет обработчики через KeyedScheduler; отклоненные нажатия получают короткий ответ
+class KeyedSchedulerMiddleware(BaseMiddleware):
+    def __init__(self, scheduler, key=callback_key):
+        self.scheduler = scheduler
+        self.key = key
+
+    async def __call__(self, handler, event, data):
+        accepted, result = await self.scheduler.run(self.key(event, data), handler, event, data)
+        if not accepted:
+            # Под нагрузкой нажатие часто уже устарело, и Telegram отклоняет ответ на него
+            try:
+                await event.answer("Слишком много нажатий, подождите.")
+            except TelegramBadRequest:
+                pass
+        return result
@@ -1,78 +1,117 @@
-import sqlite3
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import FSInputFile, Message, ReplyKeyboardMarkup, KeyboardButton
+
+from callback_codec import FINISH, RESULTS, VOTE, CallbackRoutes
+from deadline_scheduler import DeadlineScheduler, parse_duration
+from edits import EditCoordinator
+from export import export_filename, export_poll, parse_export_args
+from keyboards import FINISH_KEYBOARD, KeyboardTemplates
+from load_shedding import LoadShedder
+from metrics import Metrics
+from outbound import OutboundScheduler
+from poll_storage import create_storage
+from task_queues import KeyedScheduler, KeyedSchedulerMiddleware
+from webhook import run_bot
 
 # Загружаем переменные из .env файла
 load_dotenv()
 
 API_TOKEN = os.getenv('API_TOKEN')
 ADMIN_IDS = {838959021,838959024}  # Список ID администраторов
+GROUP_ID = int(os.getenv('GROUP_ID', '0'))  # Чат для итогов опросов, завершенных по времени; 0 — не отправлять
 
 bot = Bot(token=API_TOKEN)
+outbound = OutboundScheduler()
+bot.session.middleware(outbound)  # Лимиты Telegram на отправку и повтор после 429
 dp = Dispatcher()
+callback_routes = CallbackRoutes()  # Нажатия кнопок опроса: действие из callback_data -> обработчик
+callback_routes.register(dp.callback_query)
+
+
+# Хранилище опросов: по умолчанию активные опросы в памяти с записью в SQLite, другие варианты через POLL_STORAGE
+# (см. poll_storage.py)
+storage = create_storage()
+keyboards = KeyboardTemplates()
+edits = EditCoordinator()
+
+# Нажатия одного пользователя в одном опросе обрабатываются по очереди, разные — параллельно
+task_scheduler = KeyedScheduler()
+dp.callback_query.middleware(KeyedSchedulerMiddleware(task_scheduler))
+
+# При наплыве: устаревшие нажатия отбрасываются, парные переключения одного варианта взаимно отменяются
+load_shedder = LoadShedder()
+load_shedder.setup(dp.callback_query)
+
+# Задержки обработчиков, запросов SQLite и Telegram API (/metrics и /stats). Регистрируется после очереди
+# нажатий и сброса нагрузки, чтобы время обработчика не включало ожидание в очереди
+metrics = Metrics()
+metrics.setup(dp, bot, getattr(storage, 'db', None))
+metrics.register_stats('tasks', task_scheduler.stats)
+metrics.register_stats('shedding', load_shedder.stats)
+metrics.register_stats('storage', storage.stats)
+
+
+# Инициализация хранилища опросов (для SQLite — миграции базы данных) и сроков завершения опросов.
+# При запуске через sharding.py сроки после перезапуска восстанавливает только первый процесс.
+async def init_db():
+    await storage.start()
+    if os.getenv('SHARD_ID', '0') == '0':
+        for poll_id, closes_at in await storage.pending_deadlines():
+            deadlines.schedule(poll_id, closes_at)
+
+
+# Результаты опроса по счетчикам хранилища: [(вариант, количество голосов)]
+async def get_poll_results(poll_id):
+    poll = await storage.get_poll(poll_id)
+    if poll is None:
+        return []
+    counts = await storage.get_tallies(poll_id)
+    return [(option_text, counts.get(option_id, 0)) for option_id, option_text in poll.options]
+
+
+# Завершение опроса по сроку: опрос закрывается, итоги отправляются в GROUP_ID
+async def close_expired_poll(poll_id):
+    poll = await storage.get_poll(poll_id)
+    if poll is None or not poll.active:
+        return
+    # Опрос могли перезапустить без срока или с более поздним сроком (например, в другом процессе)
+    if poll.closes_at is None or poll.closes_at > time.time():
+        return
+    await storage.close_poll(poll_id)
+    if not GROUP_ID:
+        return
+
+    results = await get_poll_results(poll_id)
+    result_text = "\n".join([f"{option}: {count} голосов" for option, count in results])
+    await bot.send_message(GROUP_ID, f"Опрос завершен по времени.\n\nОпрос: {poll.question}\n{result_text}")
 
 
-# Соединение с базой данных SQLite
-def execute_query(query, args=(), fetch=False):
-    with sqlite3.connect('polls.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, args)
-        conn.commit()
-        if fetch:
-            return cursor.fetchall()
-
-
-# Инициализация базы данных
-def init_db():
-    execute_query('''CREATE TABLE IF NOT EXISTS polls (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        question TEXT,
-                        active INTEGER
-                    )''')
-    execute_query('''CREATE TABLE IF NOT EXISTS options (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        poll_id INTEGER,
-                        option_text TEXT,
-                        FOREIGN KEY (poll_id) REFERENCES polls (id)
-                    )''')
-    execute_query('''CREATE TABLE IF NOT EXISTS votes (
-                        user_id INTEGER,
-                        poll_id INTEGER,
-                        option_id INTEGER,
-                        PRIMARY KEY (user_id, poll_id, option_id)
-                    )''')
+# Один таймер на все опросы со сроком завершения
+deadlines = DeadlineScheduler(close_expired_poll)
+metrics.register_stats('deadlines', deadlines.stats)
 
 
 # Функция для создания клавиатуры с вариантами ответов
-def create_poll_keyboard(poll_id, selected_options=None, is_voting=True):
-    options = execute_query("SELECT id, option_text FROM options WHERE poll_id = ?", (poll_id,), fetch=True)
+async def create_poll_keyboard(poll_id, selected_options=None, is_voting=True):
+    poll = await storage.get_poll(poll_id)
+    options = poll.options if poll else None
 
     if not options:
         print(f"Не найдены варианты для опроса с poll_id = {poll_id}")
         return None
 
-    buttons = []
-    for option_id, option_text in options:
-        button_text = f"✓ {option_text}" if selected_options and option_id in selected_options else option_text
-        buttons.append([InlineKeyboardButton(text=button_text, callback_data=f'vote:{poll_id}:{option_id}')])
-
-    if is_voting:
-        buttons.append([InlineKeyboardButton(text="Проголосовать", callback_data=f'finish_vote:{poll_id}')])
-    else:
-        buttons.append([InlineKeyboardButton(text="Посмотреть результаты", callback_data=f'show_results:{poll_id}')])
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    return keyboard
+    # Клавиатура собирается из готового шаблона опроса по набору выбранных вариантов
+    return keyboards.build(poll_id, options, selected_options, is_voting)
 
 
 # Функция для создания клавиатуры с завершением голосования
 def create_finish_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Голосование завершено", callback_data='voting_ended')]
-    ])
+    return FINISH_KEYBOARD
 
 
 # Функция для создания главного меню
@@ -104,6 +143,12 @@ async def create_poll_command(message: Message):
     try:
         command_text = message.text.split(' ', 1)[1].strip()
 
+        # Необязательная длительность перед вопросом: /create_poll 30m Вопрос? ...
+        duration_text = command_text.split(' ', 1)[0]
+        duration = parse_duration(duration_text)
+        if duration is not None:
+            command_text = command_text.split(' ', 1)[1].strip()
+
         if '?' not in command_text:
             raise ValueError("Не найден знак вопроса '?' в команде.")
 
@@ -114,43 +159,70 @@ async def create_poll_command(message: Message):
         if len(options) < 2:
             raise ValueError("Необходимо указать как минимум два варианта ответа.")
 
-        execute_query("UPDATE polls SET active = 0 WHERE active = 1")
+        # Активным остается только новый опрос
+        for poll_id in await storage.close_poll():
+            deadlines.cancel(poll_id)
+        closes_at = time.time() + duration if duration else None
+        poll_id = await storage.create_poll(question, options, active=True, closes_at=closes_at)
+
+        text = "Опрос создан! Используй кнопку 'Запустить опрос', чтобы начать."
+        if closes_at:
+            deadlines.schedule(poll_id, closes_at)
+            text += f"\nОпрос завершится автоматически через {duration_text}."
+        await message.answer(text, reply_markup=create_main_menu(is_admin=True))
+
+    except (IndexError, ValueError) as e:
+        await message.answer(f"Ошибка: {str(e)}\n"
+                             f"Пример: /create_poll [30m] Вопрос? Вариант 1, Вариант 2, Вариант 3\n"
+                             f"Длительность (необязательно): 90s, 30m, 2h, 1d")
 
-        with sqlite3.connect('polls.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO polls (question, active) VALUES (?, 1)", (question,))
-            poll_id = cursor.lastrowid
 
-            for option in options:
-                cursor.execute("INSERT INTO options (poll_id, option_text) VALUES (?, ?)", (poll_id, option))
-            conn.commit()
+# Сводка метрик для администратора
+@dp.message(Command('stats'))
+async def stats_command(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для просмотра статистики.")
+        return
+    await message.answer(metrics.summary())
 
-        await message.answer("Опрос создан! Используй кнопку 'Запустить опрос', чтобы начать.",
-                             reply_markup=create_main_menu(is_admin=True))
 
-    except (IndexError, ValueError) as e:
-        await message.answer(f"Ошибка: {str(e)}\nПример: /create_poll Вопрос? Вариант 1, Вариант 2, Вариант 3")
+# Выгрузка голосов опроса файлом: /export <poll_id> [csv|ndjson]
+@dp.message(Command('export'))
+async def export_command(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выгрузки результатов.")
+        return
+
+    args = parse_export_args(message.text)
+    if args is None:
+        await message.answer("Пример: /export 1 csv (форматы: csv, ndjson)")
+        return
+
+    poll_id, fmt = args
+    path, rows = await export_poll(storage, poll_id, fmt)
+    try:
+        if not rows:
+            await message.answer("В этом опросе нет голосов.")
+            return
+        await message.answer_document(FSInputFile(path, filename=export_filename(poll_id, fmt)),
+                                      caption=f"Голосов: {rows}")
+    finally:
+        os.remove(path)
 
 
 # Команда для старта опроса
 @dp.message(F.text == "Запустить опрос")
 async def start_poll_command(message: Message):
-    poll = execute_query("SELECT id, question, active FROM polls WHERE active = 1", fetch=True)
+    polls = await storage.active_polls()
 
-    if not poll:
+    if not polls:
         await message.answer("Нет активных опросов.")
         return
 
-    poll_id, question, is_active = poll[0]
-    if is_active == 0:
-        await message.answer("Опрос завершен. Результаты:")
-        return
-
-    user_votes = execute_query("SELECT option_id FROM votes WHERE user_id = ? AND poll_id = ?",
-                               (message.from_user.id, poll_id), fetch=True)
-    selected_options = {option_id for option_id, in user_votes}
+    poll_id, question = polls[0].poll_id, polls[0].question
+    selected_options = await storage.get_selection(message.from_user.id, poll_id)
 
-    poll_keyboard = create_poll_keyboard(poll_id, selected_options)
+    poll_keyboard = await create_poll_keyboard(poll_id, selected_options)
 
     if not poll_keyboard:
         await message.answer("Ошибка: невозможно создать клавиатуру для опроса.")
@@ -167,29 +239,21 @@ async def new_poll(message: Message):
         return
 
     await message.answer(
-        "Введите команду для создания нового опроса. Пример: /create_poll Вопрос? Вариант 1, Вариант 2, Вариант 3",
+        "Введите команду для создания нового опроса. Пример: /create_poll [30m] Вопрос? Вариант 1, Вариант 2, Вариант 3",
         reply_markup=create_main_menu(is_admin=True))
 
 
 # Команда для показа результатов
 @dp.message(F.text == "Показать результаты")
 async def show_results(message: Message):
-    active_poll = execute_query("SELECT id, question FROM polls WHERE active = 0", fetch=True)
-    if not active_poll:
+    results = await storage.closed_results()
+    if not results:
         await message.answer("Нет завершенных опросов.")
         return
 
     results_text = ""
-    for poll_id, question in active_poll:
-        results = execute_query("""
-            SELECT option_text, COUNT(votes.option_id) 
-            FROM options
-            LEFT JOIN votes ON options.id = votes.option_id
-            WHERE options.poll_id = ?
-            GROUP BY options.id
-        """, (poll_id,), fetch=True)
-
-        result_text = "\n".join([f"{option}: {count} голосов" for option, count in results])
+    for question, rows in results:
+        result_text = "\n".join([f"{option}: {count} голосов" for option, count in rows])
         results_text += f"\n\nОпрос: {question}\n{result_text}"
 
     await message.answer(results_text)
@@ -202,142 +266,98 @@ async def finish_active_poll(message: Message):
         await message.answer("У вас нет прав для завершения активных опросов.")
         return
 
-    active_poll = execute_query("SELECT id FROM polls WHERE active = 1", fetch=True)
-    if not active_poll:
+    poll_ids = await storage.close_poll()
+    if not poll_ids:
         await message.answer("Нет активных опросов для завершения.")
         return
-
-    for poll_id, in active_poll:
-        execute_query("UPDATE polls SET active = 0 WHERE id = ?", (poll_id,))
+    for poll_id in poll_ids:
+        deadlines.cancel(poll_id)
 
     await message.answer("Активные опросы завершены.", reply_markup=create_main_menu(is_admin=True))
 
 
 # Обработчик нажатий на кнопки голосования
-@dp.callback_query(F.data.startswith('vote'))
-async def handle_vote(callback_query):
+@callback_routes.route(VOTE)
+async def handle_vote(callback_query, poll_id, option_id):
     user_id = callback_query.from_user.id
-    _, poll_id, option_id = callback_query.data.split(':')
-
-    option_id = int(option_id)
-    poll_id = int(poll_id)
 
     # Получаем статус опроса
-    poll_active = execute_query("SELECT active FROM polls WHERE id = ?", (poll_id,), fetch=True)
-    if not poll_active or poll_active[0][0] == 0:
+    poll = await storage.get_poll(poll_id)
+    if not poll or not poll.active:
         await callback_query.answer("Опрос завершен.")
         return
 
-    # Запись или удаление голоса в базе данных
-    existing_vote = execute_query("SELECT 1 FROM votes WHERE user_id = ? AND poll_id = ? AND option_id = ?",
-                                  (user_id, poll_id, option_id), fetch=True)
-
-    if existing_vote:
-        execute_query("DELETE FROM votes WHERE user_id = ? AND poll_id = ? AND option_id = ?", (user_id, poll_id,
-        option_id))
-    else:
-        execute_query("INSERT INTO votes (user_id, poll_id, option_id) VALUES (?, ?, ?)", (user_id, poll_id, option_id))
-
-    # Получаем обновленные выбранные варианты для текущего пользователя
-    user_votes = execute_query("SELECT option_id FROM votes WHERE user_id = ? AND poll_id = ?", (user_id, poll_id), fetch=True)
-    selected_options = {option_id for option_id, in user_votes}
+    # Запись или удаление голоса, получаем обновленные выбранные варианты
+    selected_options = await storage.toggle_vote(user_id, poll_id, option_id)
 
     # Получаем вопрос опроса
-    question = execute_query("SELECT question FROM polls WHERE id = ?", (poll_id,), fetch=True)
-    if question:
-        question = question[0][0]
-    else:
-        question = "Вопрос не найден"
+    question = poll.question
 
     # Создаем клавиатуру с обновленным состоянием
-    new_poll_keyboard = create_poll_keyboard(poll_id, selected_options)
+    new_poll_keyboard = await create_poll_keyboard(poll_id, selected_options)
 
     if new_poll_keyboard:
-        # Обновляем сообщение с опросом
-        await callback_query.message.edit_text(
-            text=f"Опрос: {question}\nВыберите один или несколько вариантов:",
-            reply_markup=new_poll_keyboard
-        )
+        # Отвечаем сразу, а обновление сообщения откладываем и объединяем с соседними нажатиями
+        await callback_query.answer()
+        edits.schedule(bot, callback_query.message.chat.id, callback_query.message.message_id,
+                       text=f"Опрос: {question}\nВыберите один или несколько вариантов:",
+                       reply_markup=new_poll_keyboard)
     else:
         # Сообщаем об ошибке
         await callback_query.answer("Ошибка: невозможно обновить клавиатуру для опроса.", show_alert=True)
 
-    await callback_query.answer()
-
 # Обработчик завершения голосования (кнопка "Проголосовать")
-@dp.callback_query(F.data.startswith('finish_vote'))
-async def finish_vote(callback_query):
-    _, poll_id = callback_query.data.split(':')
-    poll_id = int(poll_id)
-
+@callback_routes.route(FINISH)
+async def finish_vote(callback_query, poll_id):
     user_id = callback_query.from_user.id
 
     # Получаем вопрос и варианты ответа
-    question = execute_query("SELECT question FROM polls WHERE id = ?", (poll_id,), fetch=True)
-    if question:
-        question = question[0][0]
-    else:
-        question = "Вопрос не найден"
+    poll = await storage.get_poll(poll_id)
+    question = poll.question if poll else "Вопрос не найден"
 
     # Получаем результаты
-    results = execute_query("""
-        SELECT option_text, COUNT(votes.option_id) 
-        FROM options
-        LEFT JOIN votes ON options.id = votes.option_id
-        WHERE options.poll_id = ?
-        GROUP BY options.id
-    """, (poll_id,), fetch=True)
+    results = await get_poll_results(poll_id)
 
     result_text = "\n".join([f"{option}: {count} голосов" for option, count in results])
     result_text = f"Ваш голос учтен.\n\nОпрос: {question}\n{result_text}"
 
     # Обновляем сообщение с результатами
     finish_keyboard = create_finish_keyboard()
-    await callback_query.message.edit_text(
-        text=result_text,
-        reply_markup=finish_keyboard
-    )
-
     await callback_query.answer()
+    edits.schedule(bot, callback_query.message.chat.id, callback_query.message.message_id,
+                   text=result_text, reply_markup=finish_keyboard)
 
 # Обработчик показа результатов
-@dp.callback_query(F.data.startswith('show_results'))
-async def show_results(callback_query):
-    _, poll_id = callback_query.data.split(':')
-    poll_id = int(poll_id)
-
+@callback_routes.route(RESULTS)
+async def show_results(callback_query, poll_id):
     # Получаем вопрос и результаты
-    question = execute_query("SELECT question FROM polls WHERE id = ?", (poll_id,), fetch=True)
-    if question:
-        question = question[0][0]
-    else:
-        question = "Вопрос не найден"
+    poll = await storage.get_poll(poll_id)
+    question = poll.question if poll else "Вопрос не найден"
 
-    results = execute_query("""
-        SELECT option_text, COUNT(votes.option_id) 
-        FROM options
-        LEFT JOIN votes ON options.id = votes.option_id
-        WHERE options.poll_id = ?
-        GROUP BY options.id
-    """, (poll_id,), fetch=True)
+    results = await get_poll_results(poll_id)
 
     result_text = "\n".join([f"{option}: {count} голосов" for option, count in results])
     result_text = f"Результаты опроса:\nВопрос: {question}\n{result_text}"
 
     # Обновляем сообщение с результатами
     finish_keyboard = create_finish_keyboard()
-    await callback_query.message.edit_text(
-        text=result_text,
-        reply_markup=finish_keyboard
-    )
-
     await callback_query.answer()
+    edits.schedule(bot, callback_query.message.chat.id, callback_query.message.message_id,
+                   text=result_text, reply_markup=finish_keyboard)
+
+# Остановка бота: останавливаем таймер сроков, отправляем отложенные правки, записываем голоса и закрываем хранилище
+async def shutdown():
+    await deadlines.close()
+    await edits.flush()
+    await storage.close()
+
 
 # Запуск бота
 async def main():
-    init_db()  # Инициализация базы данных
-    await dp.start_polling(bot)
+    dp.startup.register(init_db)  # Инициализация хранилища опросов
+    dp.shutdown.register(shutdown)
+    await run_bot(dp, bot, metrics=metrics)
+
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,89 @@
+import asyncio
+import os
+
+from tallies import apply_tally_deltas
+
+VOTE_FLUSH_INTERVAL = float(os.getenv('VOTE_FLUSH_INTERVAL', '0.005'))
+VOTE_FLUSH_SIZE = int(os.getenv('VOTE_FLUSH_SIZE', '256'))
+
+
+# Очередь записи голосов: переключения от многих обработчиков копятся и записываются
+# одной транзакцией раз в несколько миллисекунд (или по достижении VOTE_FLUSH_SIZE операций),
+# при этом каждый вызывающий получает свой результат. Счетчики в таблице tallies и в TallyCache
+# обновляются в том же пакете.
+class VoteWriteQueue:
+    def __init__(self, db, tallies=None, interval=VOTE_FLUSH_INTERVAL, max_batch=VOTE_FLUSH_SIZE):
+        self.db = db
+        self.tallies = tallies
+        self.interval = interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._flushes = set()
+
+    # Переключает голос пользователя и возвращает множество выбранных им вариантов после записи
+    async def toggle(self, user_id, poll_id, option_id, user_name=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((user_id, poll_id, option_id, user_name, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.interval, self._flush_now)
+
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        ops = [op[:4] for op in batch]
+        try:
+            results, deltas = await self.db.transaction(self._apply, ops)
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if self.tallies is not None:
+            self.tallies.apply(deltas)
+
+        for (*_, future), selected in zip(batch, results):
+            if not future.done():
+                future.set_result(selected)
+
+    # Выполняется в потоке писателя внутри одной транзакции
+    def _apply(self, conn, ops):
+        results = []
+        deltas = {}
+        for user_id, poll_id, option_id, user_name in ops:
+            cursor = conn.execute("DELETE FROM votes WHERE user_id = ? AND poll_id = ? AND option_id = ?",
+                                  (user_id, poll_id, option_id))
+            delta = -1 if cursor.rowcount else 1
+            deltas[poll_id, option_id] = deltas.get((poll_id, option_id), 0) + delta
+            if delta > 0:
+                conn.execute("INSERT INTO votes (user_id, user_name, poll_id, option_id) VALUES (?, ?, ?, ?)",
+                             (user_id, user_name, poll_id, option_id))
+
+            user_votes = conn.execute("SELECT option_id FROM votes WHERE user_id = ? AND poll_id = ?",
+                                      (user_id, poll_id))
+            results.append({vote_id for vote_id, in user_votes})
+
+        apply_tally_deltas(conn, deltas)
+        return results, deltas
+
+    # Записывает все накопленные операции; вызывается при остановке бота
+    async def close(self):
+        self._flush_now()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from metrics import METRICS_PORT, add_metrics_route, start_metrics_server
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling')  # polling или webhook
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес сервера; без него вебхук в Telegram не регистрируется
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '10'))
+
+logger = logging.getLogger(__name__)
+
+
+# Обработчик вебхука, который при остановке дожидается уже принятых обновлений
+class DrainingRequestHandler(SimpleRequestHandler):
+    def __init__(self, dispatcher, bot, drain_timeout=WEBHOOK_DRAIN_TIMEOUT, **kwargs):
+        super().__init__(dispatcher, bot, **kwargs)
+        self.drain_timeout = drain_timeout
+
+    @property
+    def in_flight(self):
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self):
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info("Ожидание завершения %s обработчиков", len(tasks))
+        done, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        if pending:
+            logger.warning("%s обработчиков не завершились за %s с", len(pending), self.drain_timeout)
+
+    # Сессию бота закрывает run_webhook после обработчиков остановки диспетчера
+    async def close(self):
+        await self.drain()
+
+
+# Приложение aiohttp с маршрутом вебхука; обработчики остановки диспетчера выполняются после дренажа
+def create_app(dp, bot, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, metrics=None):
+    app = web.Application()
+    handler = DrainingRequestHandler(dp, bot, secret_token=secret_token)
+    handler.register(app, path=path)
+    if metrics is not None and metrics.enabled:
+        add_metrics_route(app, metrics)
+    setup_application(app, dp, bot=bot)
+    app['webhook_handler'] = handler
+    return app
+
+
+async def run_webhook(dp, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, url=WEBHOOK_URL,
+                      secret_token=WEBHOOK_SECRET, drop_pending_updates=False, metrics=None):
+    app = create_app(dp, bot, path=path, secret_token=secret_token, metrics=metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await site.start()
+        if url:
+            await bot.set_webhook(url.rstrip('/') + path, secret_token=secret_token,
+                                  drop_pending_updates=drop_pending_updates)
+        logger.info("Вебхук слушает %s:%s%s", host, port, path)
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        # Сначала перестаем принимать запросы, затем ждем обработчики и останавливаем диспетчер
+        await runner.cleanup()
+        await bot.session.close()
+
+
+# Запуск бота в режиме, выбранном переменной окружения BOT_MODE.
+# В режиме webhook /metrics отдается сервером вебхука, в режиме polling — отдельным сервером на METRICS_PORT.
+async def run_bot(dp, bot, drop_pending_updates=False, metrics=None):
+    if BOT_MODE == 'webhook':
+        await run_webhook(dp, bot, drop_pending_updates=drop_pending_updates, metrics=metrics)
+        return
+
+    metrics_runner = None
+    if metrics is not None and metrics.enabled and METRICS_PORT:
+        metrics_runner = await start_metrics_server(metrics)
+    try:
+        await bot.delete_webhook(drop_pending_updates=drop_pending_updates)
+        await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()